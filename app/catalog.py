@@ -0,0 +1,559 @@
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+from app import database
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines run a single worker anyway
+    fcntl = None
+
+# Opt-in read-only catalog snapshot shared by every worker through mmap
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "0") != "0"
+# Batch /add-audio-meta writes into one rebuild per interval
+CATALOG_REBUILD_DELAY = float(os.getenv("CATALOG_REBUILD_DELAY", "1.0"))
+# Rows written since the last full rebuild live in a small delta segment until
+# there are more than this many, then they're merged into a new base
+CATALOG_DELTA_ROWS = int(os.getenv("CATALOG_DELTA_ROWS", "10000"))
+
+MAGIC = b"6677CAT3"
+# magic, generation, catalog_changes counter, entry count, tag count, tag table,
+# postings, heap offsets. A delta carries the generation of the base it extends.
+HEADER = struct.Struct("<8sQQQQQQQ")
+# Source and tag table entries: key offset, key length, value offset, value length.
+# A source entry with an empty value is a row deleted since the base was built.
+ENTRY = struct.Struct("<QIQI")
+BUILD_CHUNK = 5000
+
+_lock = threading.Lock()
+_snapshot: Optional["CatalogView"] = None
+_loaded_generation = -1
+_counter: Optional[mmap.mmap] = None
+_rebuild_timer: Optional[threading.Timer] = None
+_rebuild_dirty = False
+
+
+def snapshot_path() -> str:
+    return database.DATABASE_NAME + ".catalog"
+
+
+def delta_path() -> str:
+    return database.DATABASE_NAME + ".catalog.delta"
+
+
+def counter_path() -> str:
+    return database.DATABASE_NAME + ".catalog.gen"
+
+
+class Snapshot:
+    """Read-only view over a snapshot file.
+
+    Layout: header | src_id table | tag table | postings | heap. Both tables are
+    sorted by key bytes so lookups binary-search the mapping directly, and the
+    pages are shared between every process that maps the same file.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            self.generation,
+            self.changes,
+            self.count,
+            self.tag_count,
+            self.tag_table,
+            self.postings,
+            self.heap,
+        ) = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        self.view = memoryview(self.buf)
+
+    def _entry(self, table: int, index: int):
+        return ENTRY.unpack_from(self.buf, table + index * ENTRY.size)
+
+    def _key(self, table: int, index: int) -> bytes:
+        key_off, key_len, _, _ = self._entry(table, index)
+        start = self.heap + key_off
+        return self.buf[start : start + key_len]
+
+    def _search(self, table: int, size: int, key: bytes) -> int:
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(table, mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < size and self._key(table, lo) == key:
+            return lo
+        return -1
+
+    def src_id(self, index: int) -> str:
+        return self._key(HEADER.size, index).decode("utf-8")
+
+    def get(self, src_id: str) -> Optional[dict]:
+        index = self._search(HEADER.size, self.count, src_id.encode("utf-8"))
+        if index < 0:
+            return None
+        _, _, blob_off, blob_len = self._entry(HEADER.size, index)
+        if not blob_len:
+            return None
+        start = self.heap + blob_off
+        return json.loads(self.buf[start : start + blob_len])
+
+    def tag_postings(self, tag: str) -> memoryview:
+        """Indices into the src_id table of every audio carrying `tag`."""
+        index = self._search(self.tag_table, self.tag_count, tag.encode("utf-8"))
+        if index < 0:
+            return memoryview(b"").cast("I")
+        _, _, off, count = self._entry(self.tag_table, index)
+        start = self.postings + off
+        return self.view[start : start + count * 4].cast("I")
+
+
+class CatalogView:
+    """The base snapshot with the delta segment, if any, laid over it."""
+
+    def __init__(self, base: Snapshot, delta: Optional[Snapshot] = None):
+        self.base = base
+        self.delta = delta
+        # Base entries the delta updates or deletes
+        self.replaced = (
+            {delta.src_id(index) for index in range(delta.count)} if delta else set()
+        )
+
+    def get(self, src_id: str) -> Optional[dict]:
+        if src_id in self.replaced:
+            return self.delta.get(src_id)
+        return self.base.get(src_id)
+
+
+def _open_counter() -> mmap.mmap:
+    path = counter_path()
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < 8:
+            os.ftruncate(fd, 8)
+        return mmap.mmap(fd, 8)
+    finally:
+        os.close(fd)
+
+
+def _read_generation() -> int:
+    return struct.unpack_from("<Q", _counter, 0)[0]
+
+
+def _publish(generation: int):
+    """Bump the counter every worker polls before using its snapshot."""
+    struct.pack_into("<Q", _counter, 0, generation)
+    _counter.flush()
+
+
+def _read_header(path: str) -> Optional[tuple]:
+    try:
+        with open(path, "rb") as f:
+            header = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return header if header[0] == MAGIC else None
+
+
+class _FileLock:
+    """Cross-process lock so only one worker rebuilds at a time."""
+
+    def __enter__(self):
+        self.f = open(counter_path() + ".lock", "w")
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+# Images come from a correlated subquery rather than a join, so they don't
+# multiply with tags and their probed sizes arrive in the same row
+AUDIO_META_SELECT = """
+    SELECT am.*, GROUP_CONCAT(DISTINCT t.name) as tags,
+           (SELECT json_group_array(json_object(
+                       'url', i.image_url, 'width', i.width,
+                       'height', i.height, 'bytes', i.image_bytes))
+            FROM images i WHERE i.src_id = am.src_id) as image_meta
+    FROM audio_metadata am
+    LEFT JOIN audio_tags at ON am.src_id = at.src_id
+    LEFT JOIN tags t ON at.tag_id = t.id
+"""
+
+
+def parse_audio_meta(row) -> dict:
+    """Turn an AUDIO_META_SELECT row into the fetch_audio_meta response."""
+    audio_meta = dict(row)
+    audio_meta["tags"] = audio_meta["tags"].split(",") if audio_meta["tags"] else []
+    image_meta = []
+    for entry in json.loads(audio_meta["image_meta"] or "[]"):
+        if entry["url"] and all(e["url"] != entry["url"] for e in image_meta):
+            image_meta.append(entry)
+    audio_meta["images"] = [entry["url"] for entry in image_meta]
+    audio_meta["image_meta"] = image_meta
+    return audio_meta
+
+
+def _all_rows(cur):
+    """Every catalog row in src_id order, as (src_id, row) pairs.
+
+    Rows are read in short keyset-paginated chunks so the build never holds
+    SQLite's shared lock long enough to stall writers.
+    """
+    last = ""
+    while True:
+        cur.execute(
+            AUDIO_META_SELECT
+            + """
+            WHERE am.src_id > ?
+            GROUP BY am.src_id
+            ORDER BY am.src_id
+            LIMIT ?
+            """,
+            (last, BUILD_CHUNK),
+        )
+        rows = cur.fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row["src_id"], row
+        last = rows[-1]["src_id"]
+
+
+def _changed_rows(cur, since: int):
+    """Rows written at or after catalog_changes count `since`, in src_id order.
+
+    Deleted rows come back as (src_id, None).
+    """
+    cur.execute(
+        "SELECT src_id FROM catalog_dirty WHERE changed >= ? ORDER BY src_id",
+        (since,),
+    )
+    src_ids = [row["src_id"] for row in cur.fetchall()]
+    cur.execute(
+        AUDIO_META_SELECT
+        + """
+        WHERE am.src_id IN (SELECT src_id FROM catalog_dirty WHERE changed >= ?)
+        GROUP BY am.src_id
+        """,
+        (since,),
+    )
+    rows = {row["src_id"]: row for row in cur.fetchall()}
+    for src_id in src_ids:
+        yield src_id, rows.get(src_id)
+
+
+def build_snapshot(path: str, generation: int, since: Optional[int] = None) -> int:
+    """Write a snapshot of the catalog to `path`, return the count it reflects.
+
+    With `since`, only rows written since that catalog_changes count go in,
+    which is how the delta segment is built.
+    """
+    entries = bytearray()
+    postings: Dict[str, array] = {}
+    heap_path = path + ".heap"
+    conn = database.get_db()
+    cur = conn.cursor()
+    # Read first: writes made during the build leave the snapshot marked stale
+    changes = database.catalog_changes(cur)
+    rows = _all_rows(cur) if since is None else _changed_rows(cur, since)
+    count = 0
+    with open(heap_path, "wb") as heap:
+        for src_id, row in rows:
+            key = src_id.encode("utf-8")
+            key_off = heap.tell()
+            heap.write(key)
+            if row is None:
+                entries += ENTRY.pack(key_off, len(key), key_off + len(key), 0)
+                count += 1
+                continue
+            audio_meta = parse_audio_meta(row)
+            blob = json.dumps(audio_meta, ensure_ascii=False).encode("utf-8")
+            heap.write(blob)
+            entries += ENTRY.pack(key_off, len(key), key_off + len(key), len(blob))
+            for tag in audio_meta["tags"]:
+                postings.setdefault(tag, array("I")).append(count)
+            count += 1
+
+        # Tag names go to the end of the heap, tag table sorted by name bytes
+        tag_entries = bytearray()
+        postings_blob = bytearray()
+        for tag in sorted(postings, key=lambda name: name.encode("utf-8")):
+            name = tag.encode("utf-8")
+            name_off = heap.tell()
+            heap.write(name)
+            tag_entries += ENTRY.pack(
+                name_off, len(name), len(postings_blob), len(postings[tag])
+            )
+            postings_blob += postings[tag].tobytes()
+    conn.close()
+
+    tag_table = HEADER.size + len(entries)
+    postings_off = tag_table + len(tag_entries)
+    heap_off = postings_off + len(postings_blob)
+    with open(path, "wb") as out, open(heap_path, "rb") as heap:
+        out.write(
+            HEADER.pack(
+                MAGIC,
+                generation,
+                changes,
+                count,
+                len(postings),
+                tag_table,
+                postings_off,
+                heap_off,
+            )
+        )
+        out.write(entries)
+        out.write(tag_entries)
+        out.write(postings_blob)
+        while True:
+            chunk = heap.read(1 << 20)
+            if not chunk:
+                break
+            out.write(chunk)
+    os.remove(heap_path)
+    return changes
+
+
+def _is_current() -> bool:
+    """Whether the base snapshot on disk was built from the catalog as it is now."""
+    header = _read_header(snapshot_path())
+    if header is None:
+        return False
+    conn = database.get_db()
+    changes = database.catalog_changes(conn.cursor())
+    conn.close()
+    return header[2] == changes
+
+
+def rebuild(only_if_stale: bool = False):
+    """Rebuild the base snapshot and bump the generation every worker polls."""
+    global _counter
+    if _counter is None:
+        _counter = _open_counter()
+    with _FileLock():
+        if only_if_stale and _is_current():
+            return
+        generation = _read_generation() + 1
+        tmp_path = f"{snapshot_path()}.{os.getpid()}.tmp"
+        changes = build_snapshot(tmp_path, generation)
+        # Workers still mapping the old files keep reading them until they swap
+        os.replace(tmp_path, snapshot_path())
+        # Everything in the delta is in the new base
+        if os.path.exists(delta_path()):
+            os.remove(delta_path())
+        _publish(generation)
+
+    conn = database.get_db()
+    conn.execute("DELETE FROM catalog_dirty WHERE changed < ?", (changes,))
+    conn.commit()
+    conn.close()
+
+
+def _update_delta() -> bool:
+    """Rewrite the delta segment, or return False when a full rebuild is due."""
+    global _counter
+    if _counter is None:
+        _counter = _open_counter()
+    with _FileLock():
+        base = _read_header(snapshot_path())
+        if base is None:
+            return False
+        conn = database.get_db()
+        cur = conn.cursor()
+        changes = database.catalog_changes(cur)
+        delta = _read_header(delta_path())
+        if changes == base[2] or (
+            delta is not None and delta[1] == base[1] and delta[2] == changes
+        ):
+            conn.close()
+            return True
+        cur.execute("SELECT COUNT(*) FROM catalog_dirty WHERE changed >= ?", (base[2],))
+        pending = cur.fetchone()[0]
+        conn.close()
+        if pending > CATALOG_DELTA_ROWS:
+            return False
+        tmp_path = f"{delta_path()}.{os.getpid()}.tmp"
+        build_snapshot(tmp_path, base[1], since=base[2])
+        os.replace(tmp_path, delta_path())
+        _publish(_read_generation() + 1)
+    return True
+
+
+def _rebuild_in_child(database_name: str):
+    database.DATABASE_NAME = database_name
+    rebuild(only_if_stale=True)
+
+
+def update(spawn: bool = False):
+    """Bring the snapshot up to date with the catalog.
+
+    Rows written since the last full rebuild only rewrite the delta segment.
+    Past CATALOG_DELTA_ROWS the whole catalog is rebuilt instead; with `spawn`
+    that runs in a child process, so a serving worker doesn't spend its GIL
+    re-serializing every row.
+    """
+    if _update_delta():
+        return
+    if not spawn:
+        rebuild(only_if_stale=True)
+        return
+    process = multiprocessing.get_context("spawn").Process(
+        target=_rebuild_in_child, args=(database.DATABASE_NAME,), daemon=True
+    )
+    process.start()
+    process.join()
+    if process.exitcode:
+        raise RuntimeError(f"rebuild process exited with code {process.exitcode}")
+
+
+def invalidate():
+    """Drop the snapshot so every worker falls back to SQLite until a rebuild.
+
+    For writes the delta can't follow, like a reset dropping whole tables:
+    DROP TABLE doesn't fire the triggers that record deleted rows.
+    """
+    global _counter
+    if not CATALOG_SNAPSHOT:
+        return
+    if _counter is None:
+        _counter = _open_counter()
+    with _FileLock():
+        for path in (snapshot_path(), delta_path()):
+            if os.path.exists(path):
+                os.remove(path)
+        _publish(_read_generation() + 1)
+
+
+def _rebuild_loop():
+    global _rebuild_timer, _rebuild_dirty
+    while True:
+        with _lock:
+            if not _rebuild_dirty:
+                _rebuild_timer = None
+                return
+            _rebuild_dirty = False
+        try:
+            update(spawn=True)
+        except Exception as e:
+            print(f"Catalog snapshot rebuild failed: {e}")
+
+
+def request_rebuild():
+    """Schedule a debounced update after a catalog write.
+
+    A write that lands while a rebuild is running marks the flag again, so
+    the loop builds once more instead of leaving the rows out.
+    """
+    global _rebuild_timer, _rebuild_dirty
+    if not CATALOG_SNAPSHOT:
+        return
+    with _lock:
+        _rebuild_dirty = True
+        if _rebuild_timer is None:
+            _rebuild_timer = threading.Timer(CATALOG_REBUILD_DELAY, _rebuild_loop)
+            _rebuild_timer.daemon = True
+            _rebuild_timer.start()
+
+
+def init_catalog():
+    if CATALOG_SNAPSHOT:
+        # Also catches writes made while no worker was running (seed_db.py)
+        update()
+
+
+def _load() -> Optional[CatalogView]:
+    try:
+        base = Snapshot(snapshot_path())
+    except (OSError, ValueError):
+        return None
+    try:
+        delta = Snapshot(delta_path())
+    except (OSError, ValueError):
+        return CatalogView(base)
+    # A delta built against another base is about to be replaced
+    return CatalogView(base, delta if delta.generation == base.generation else None)
+
+
+def current() -> Optional[CatalogView]:
+    """The latest snapshot, remapped whenever another worker bumps the counter."""
+    global _snapshot, _loaded_generation, _counter
+    if not CATALOG_SNAPSHOT:
+        return None
+    if _counter is None:
+        _counter = _open_counter()
+    generation = _read_generation()
+    if generation != _loaded_generation:
+        with _lock:
+            if generation != _loaded_generation:
+                _snapshot = _load()
+                _loaded_generation = generation
+    return _snapshot
+
+
+def _overlap_buckets(snapshot: Snapshot, tags: set) -> Dict[int, Sequence[int]]:
+    """Indices into `snapshot` grouped by how many of `tags` they carry."""
+    if len(tags) == 1:
+        # Every posting has the same overlap, no counting needed
+        return {1: snapshot.tag_postings(next(iter(tags)))}
+    counts: Dict[int, int] = {}
+    for tag in tags:
+        for index in snapshot.tag_postings(tag):
+            counts[index] = counts.get(index, 0) + 1
+    buckets: Dict[int, List[int]] = {}
+    for index, count in counts.items():
+        buckets.setdefault(count, []).append(index)
+    return buckets
+
+
+def sample_by_tags(
+    snapshot: CatalogView, tags: List[str], limit: int, excluded: set, rng
+) -> List[str]:
+    """Highest tag overlap first, random order within the same overlap."""
+    unique = set(tags)
+    # Base entries the delta replaces are skipped, the delta has their new tags
+    segments = [
+        (snapshot.base, _overlap_buckets(snapshot.base, unique), snapshot.replaced)
+    ]
+    if snapshot.delta is not None:
+        segments.append(
+            (snapshot.delta, _overlap_buckets(snapshot.delta, unique), set())
+        )
+    # Drawing limit + every skippable entry is always enough to fill after filtering
+    draws = limit + len(excluded) + len(snapshot.replaced)
+
+    recommended = []
+    counts = {count for _, buckets, _ in segments for count in buckets}
+    for count in sorted(counts, reverse=True):
+        parts = [
+            (segment, buckets[count], skipped)
+            for segment, buckets, skipped in segments
+            if count in buckets
+        ]
+        total = sum(len(bucket) for _, bucket, _ in parts)
+        for pick in rng.sample(range(total), min(total, draws)):
+            for segment, bucket, skipped in parts:
+                if pick < len(bucket):
+                    break
+                pick -= len(bucket)
+            src_id = segment.src_id(bucket[pick])
+            if src_id not in excluded and src_id not in skipped:
+                recommended.append(src_id)
+                if len(recommended) == limit:
+                    return recommended
+    return recommended
@@ -1,10 +1,9 @@
-import requests
 import os
 import jwt
 from fastapi import APIRouter, HTTPException, Depends
 from app.models import User  # Adjusted import path
 from app.database import get_db
-from sqlalchemy.orm import Session
+from sqlite3 import Connection
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 
@@ -33,7 +32,10 @@ def create_jwt_token(data: dict) -> str:
 
 
 @router.post("/api/wechat/login", response_model=WeChatLoginResponse)
-def wechat_login(request: WeChatLoginRequest, db: Session = Depends(get_db)):
+def wechat_login(request: WeChatLoginRequest, db: Connection = Depends(get_db)):
+    # requests is only needed here, keep it off the startup path
+    import requests
+
     # Call WeChat API to get openid and session_key
     response = requests.get(
         "https://api.weixin.qq.com/sns/jscode2session",
@@ -1,68 +1,263 @@
+import os
+import re
 import sqlite3
+import sys
+import time
+import zlib
 from sqlite3 import Connection
+from typing import List
+from app import metrics, slow_queries
 
-DATABASE_NAME = "audio_app.db"
+DATABASE_NAME = os.getenv("DATABASE_NAME", "audio_app.db")
 
+# Hash-partition per-user tables across N files; 0 keeps them in DATABASE_NAME
+INTERACTION_SHARDS = int(os.getenv("INTERACTION_SHARDS", "0"))
 
-def get_db() -> Connection:
-    conn = sqlite3.connect(DATABASE_NAME)
+# The progress handler fires every N VM instructions; scan counts are sampled
+SCAN_STEP_INTERVAL = 1000
+
+# Runs of characters unicode61 keeps together (letters and digits, no "_")
+SEARCH_WORD = re.compile(r"[^\W_]+")
+
+
+def search_bigrams(text):
+    """Space-separated character bigrams of `text` for the audio_bigram index.
+
+    Each word also contributes its last character, so every character starts
+    some token and one-character terms work as prefix queries.
+    """
+    if not text:
+        return text
+    tokens = []
+    for word in SEARCH_WORD.findall(text):
+        tokens.extend(word[i : i + 2] for i in range(len(word) - 1))
+        tokens.append(word[-1])
+    return " ".join(tokens)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times each statement, labelled with the calling function."""
+
+    label = "unknown"
+
+    def execute(self, sql, parameters=()):
+        return self.timed_execute(sql, parameters, sys._getframe(1).f_code.co_name)
+
+    def timed_execute(self, sql, parameters, label: str):
+        self.label = label
+        conn = self.connection
+        head = sql.lstrip()[:15].upper()
+        steps = conn.scan_steps
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.QUERY_SECONDS.observe((self.label,), elapsed)
+            # Only explicit BEGIN IMMEDIATE waits for the lock on its own; the
+            # implicit BEGIN is deferred and must not be changed by metrics
+            if head.startswith("BEGIN IMMEDIATE"):
+                metrics.LOCK_WAIT_SECONDS.observe((self.label,), elapsed)
+            self._record_scan(steps)
+            if slow_queries.SLOW_QUERY_THRESHOLD is not None:
+                slow_queries.record(conn, sql, parameters, elapsed, self.label)
+
+    def fetchone(self):
+        steps = self.connection.scan_steps
+        row = super().fetchone()
+        if row is not None:
+            metrics.ROWS_RETURNED.inc((self.label,))
+        self._record_scan(steps)
+        return row
+
+    def fetchall(self):
+        steps = self.connection.scan_steps
+        rows = super().fetchall()
+        metrics.ROWS_RETURNED.inc((self.label,), len(rows))
+        self._record_scan(steps)
+        return rows
+
+    def _record_scan(self, steps_before: int):
+        steps = self.connection.scan_steps - steps_before
+        if steps:
+            metrics.ROWS_SCANNED.inc((self.label,), steps)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scan_steps = 0
+        self.set_progress_handler(self._count_steps, SCAN_STEP_INTERVAL)
+
+    def _count_steps(self):
+        self.scan_steps += SCAN_STEP_INTERVAL
+        return 0
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        # The C implementation of Connection.execute bypasses cursor()
+        cursor = self.cursor()
+        return cursor.timed_execute(sql, parameters, sys._getframe(1).f_code.co_name)
+
+    def commit(self):
+        caller = sys._getframe(1).f_code.co_name
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            metrics.COMMIT_SECONDS.observe((caller,), time.perf_counter() - started)
+
+
+def connect(path: str) -> Connection:
+    if metrics.METRICS_ENABLED or slow_queries.SLOW_QUERY_THRESHOLD is not None:
+        conn = sqlite3.connect(path, factory=InstrumentedConnection)
+    else:
+        conn = sqlite3.connect(path)
     conn.row_factory = sqlite3.Row
+    # Persistent, but cheap to repeat; readers no longer block on writers and
+    # compact()'s checkpoint has a WAL to truncate
+    conn.execute("PRAGMA journal_mode=WAL")
+    # Used by the audio_bigram triggers, so every writer needs it
+    conn.create_function("search_bigrams", 1, search_bigrams, deterministic=True)
     return conn
 
 
-def init_db():
+def sqlite_files(path: str) -> List[str]:
+    """A database file with its WAL and shared-memory sidecars."""
+    return [path, path + "-wal", path + "-shm"]
+
+
+def get_db() -> Connection:
+    return connect(DATABASE_NAME)
+
+
+def shard_path(index: int) -> str:
+    base = DATABASE_NAME[:-3] if DATABASE_NAME.endswith(".db") else DATABASE_NAME
+    return f"{base}.shard{index}.db"
+
+
+def shard_for(user_id: str) -> int:
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(user_id.encode("utf-8")) % INTERACTION_SHARDS
+
+
+def interaction_db_paths() -> List[str]:
+    """Every file holding user_interactions, bookmarks and comments."""
+    if not INTERACTION_SHARDS:
+        return [DATABASE_NAME]
+    return [shard_path(index) for index in range(INTERACTION_SHARDS)]
+
+
+def interaction_db_path(user_id: str) -> str:
+    if not INTERACTION_SHARDS:
+        return DATABASE_NAME
+    return shard_path(shard_for(user_id))
+
+
+def get_interaction_db(user_id: str) -> Connection:
+    """Connection to the user's interaction file alone, for write transactions.
+
+    Unlike get_user_db, nothing is attached: BEGIN IMMEDIATE takes the write
+    lock on every attached file, which would serialize all shards on the
+    catalog.
+    """
+    return connect(interaction_db_path(user_id))
+
+
+def get_user_db(user_id: str) -> Connection:
+    """Catalog connection with the user's interaction shard attached.
+
+    Queries keep using unqualified table names: the sharded tables don't exist
+    in the catalog file, so SQLite resolves them in the attached shard.
+    """
     conn = get_db()
-    cur = conn.cursor()
+    if INTERACTION_SHARDS:
+        conn.execute("ATTACH DATABASE ? AS shard", (interaction_db_path(user_id),))
+    return conn
 
+
+# Bump whenever CATALOG_SCHEMA or INTERACTION_SCHEMA changes
+SCHEMA_VERSION = 12
+
+# Catalog tables, always stored in DATABASE_NAME
+CATALOG_SCHEMA = {
     # Audio metadata table
-    cur.execute(
-        """
+    "audio_metadata": """
         CREATE TABLE IF NOT EXISTS audio_metadata (
             src_id TEXT PRIMARY KEY,
             description TEXT,
             audio_src TEXT,
             location TEXT,
             creator TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            latitude REAL,
+            longitude REAL,
+            duration_seconds REAL,
+            bitrate INTEGER,
+            audio_bytes INTEGER,
+            audio_hash TEXT
         )
-        """
-    )
-
+        """,
+    # Full-text index over audio_metadata, kept in sync by triggers
+    "audio_search": """
+        CREATE VIRTUAL TABLE IF NOT EXISTS audio_search USING fts5(
+            description,
+            location,
+            creator,
+            content='audio_metadata',
+            content_rowid='rowid',
+            tokenize='trigram'
+        )
+        """,
+    # Bigram index for terms too short for the trigram tokenizer
+    "audio_bigram": """
+        CREATE VIRTUAL TABLE IF NOT EXISTS audio_bigram USING fts5(
+            description,
+            location,
+            creator,
+            content='',
+            tokenize='unicode61 remove_diacritics 0'
+        )
+        """,
+    # Spatial index on audio_metadata coordinates, id is the audio rowid
+    "audio_geo": """
+        CREATE VIRTUAL TABLE IF NOT EXISTS audio_geo USING rtree(
+            id,
+            min_lat, max_lat,
+            min_lng, max_lng
+        )
+        """,
     # Creators table
-    cur.execute(
-        """
+    "creators": """
         CREATE TABLE IF NOT EXISTS creators (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             creator_id TEXT UNIQUE NOT NULL
         )
-        """
-    )
-
+        """,
     # Tags table
-    cur.execute(
-        """
+    "tags": """
         CREATE TABLE IF NOT EXISTS tags (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT UNIQUE NOT NULL
         )
-        """
-    )
-
+        """,
     # Images table
-    cur.execute(
-        """
+    "images": """
         CREATE TABLE IF NOT EXISTS images (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             src_id TEXT,
             image_url TEXT,
+            width INTEGER,
+            height INTEGER,
+            image_bytes INTEGER,
+            image_hash TEXT,
             FOREIGN KEY (src_id) REFERENCES audio_metadata (src_id)
         )
-        """
-    )
-
+        """,
     # Audio-Tag relationship table
-    cur.execute(
-        """
+    "audio_tags": """
         CREATE TABLE IF NOT EXISTS audio_tags (
             src_id TEXT,
             tag_id INTEGER,
@@ -70,12 +265,75 @@ def init_db():
             FOREIGN KEY (src_id) REFERENCES audio_metadata (src_id),
             FOREIGN KEY (tag_id) REFERENCES tags (id)
         )
-        """
-    )
+        """,
+    # Users table
+    "users": """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            openid TEXT UNIQUE NOT NULL,
+            session_key TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            -- Add other necessary fields here
+        )
+        """,
+    # Background reset jobs
+    "reset_jobs": """
+        CREATE TABLE IF NOT EXISTS reset_jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME,
+            worker_pid INTEGER
+        )
+        """,
+    # Incrementally maintained popularity aggregates, see app/trending.py
+    "audio_popularity": """
+        CREATE TABLE IF NOT EXISTS audio_popularity (
+            src_id TEXT PRIMARY KEY,
+            views INTEGER NOT NULL DEFAULT 0,
+            finishes INTEGER NOT NULL DEFAULT 0,
+            favorites INTEGER NOT NULL DEFAULT 0,
+            score REAL
+        )
+        """,
+    # Bumped by triggers on every write to a table the catalog snapshot reads
+    "catalog_changes": """
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            counter INTEGER NOT NULL
+        )
+        """,
+    # src_ids written since the last full snapshot, with the catalog_changes
+    # count at the time, so catalog.py can rebuild just those into a delta
+    "catalog_dirty": """
+        CREATE TABLE IF NOT EXISTS catalog_dirty (
+            src_id TEXT PRIMARY KEY,
+            changed INTEGER NOT NULL
+        )
+        """,
+    # Probed local media keyed by absolute path, see probe_media.py
+    "media_files": """
+        CREATE TABLE IF NOT EXISTS media_files (
+            path TEXT PRIMARY KEY,
+            file_name TEXT,
+            kind TEXT,
+            size INTEGER,
+            mtime REAL,
+            content_hash TEXT,
+            duration_seconds REAL,
+            bitrate INTEGER,
+            width INTEGER,
+            height INTEGER
+        )
+        """,
+}
 
+# Per-user tables, optionally hash-partitioned across shard files
+INTERACTION_SCHEMA = {
     # Updated User interactions table
-    cur.execute(
-        """
+    "user_interactions": """
         CREATE TABLE IF NOT EXISTS user_interactions (
             user_id TEXT,
             src_id TEXT,
@@ -88,12 +346,9 @@ def init_db():
             PRIMARY KEY (user_id, src_id),
             FOREIGN KEY (src_id) REFERENCES audio_metadata (src_id)
         )
-        """
-    )
-
+        """,
     # New table for bookmarks
-    cur.execute(
-        """
+    "bookmarks": """
         CREATE TABLE IF NOT EXISTS bookmarks (
             user_id TEXT,
             src_id TEXT,
@@ -101,12 +356,9 @@ def init_db():
             PRIMARY KEY (user_id, src_id, bookmark),
             FOREIGN KEY (user_id, src_id) REFERENCES user_interactions (user_id, src_id)
         )
-        """
-    )
-
+        """,
     # New table for comments
-    cur.execute(
-        """
+    "comments": """
         CREATE TABLE IF NOT EXISTS comments (
             user_id TEXT,
             src_id TEXT,
@@ -114,21 +366,322 @@ def init_db():
             PRIMARY KEY (user_id, src_id, comment),
             FOREIGN KEY (user_id, src_id) REFERENCES user_interactions (user_id, src_id)
         )
-        """
-    )
+        """,
+    # Popularity changes not yet folded into audio_popularity, see app/trending.py
+    "popularity_deltas": """
+        CREATE TABLE IF NOT EXISTS popularity_deltas (
+            src_id TEXT PRIMARY KEY,
+            views INTEGER NOT NULL DEFAULT 0,
+            finishes INTEGER NOT NULL DEFAULT 0,
+            favorites INTEGER NOT NULL DEFAULT 0,
+            score REAL
+        )
+        """,
+}
 
-    # Users table
-    cur.execute(
+# Interaction tables partitioned by user_id
+USER_TABLES = ["user_interactions", "bookmarks", "comments"]
+
+# Indexes and triggers created (and recreated on reset) alongside a table
+TABLE_EXTRAS = {
+    # Writes must keep audio_metadata rowids stable (upsert, not INSERT OR
+    # REPLACE): REPLACE deletes without firing the delete trigger
+    "audio_search": [
+        # Only reindex when indexed text changes, not on probe/geo updates
+        "DROP TRIGGER IF EXISTS audio_search_au",
         """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            openid TEXT UNIQUE NOT NULL,
-            session_key TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            -- Add other necessary fields here
-        )
+        CREATE TRIGGER IF NOT EXISTS audio_search_ai AFTER INSERT ON audio_metadata BEGIN
+            INSERT INTO audio_search (rowid, description, location, creator)
+            VALUES (new.rowid, new.description, new.location, new.creator);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS audio_search_ad AFTER DELETE ON audio_metadata BEGIN
+            INSERT INTO audio_search (audio_search, rowid, description, location, creator)
+            VALUES ('delete', old.rowid, old.description, old.location, old.creator);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS audio_search_au
+        AFTER UPDATE OF description, location, creator ON audio_metadata BEGIN
+            INSERT INTO audio_search (audio_search, rowid, description, location, creator)
+            VALUES ('delete', old.rowid, old.description, old.location, old.creator);
+            INSERT INTO audio_search (rowid, description, location, creator)
+            VALUES (new.rowid, new.description, new.location, new.creator);
+        END
+        """,
+        # Index rows that predate the table (schema upgrades)
+        "INSERT INTO audio_search (audio_search) VALUES ('rebuild')",
+    ],
+    # Contentless, so deletes must pass the same bigram text that was indexed
+    "audio_bigram": [
+        """
+        CREATE TRIGGER IF NOT EXISTS audio_bigram_ai AFTER INSERT ON audio_metadata BEGIN
+            INSERT INTO audio_bigram (rowid, description, location, creator)
+            VALUES (new.rowid, search_bigrams(new.description),
+                    search_bigrams(new.location), search_bigrams(new.creator));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS audio_bigram_ad AFTER DELETE ON audio_metadata BEGIN
+            INSERT INTO audio_bigram (audio_bigram, rowid, description, location, creator)
+            VALUES ('delete', old.rowid, search_bigrams(old.description),
+                    search_bigrams(old.location), search_bigrams(old.creator));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS audio_bigram_au
+        AFTER UPDATE OF description, location, creator ON audio_metadata BEGIN
+            INSERT INTO audio_bigram (audio_bigram, rowid, description, location, creator)
+            VALUES ('delete', old.rowid, search_bigrams(old.description),
+                    search_bigrams(old.location), search_bigrams(old.creator));
+            INSERT INTO audio_bigram (rowid, description, location, creator)
+            VALUES (new.rowid, search_bigrams(new.description),
+                    search_bigrams(new.location), search_bigrams(new.creator));
+        END
+        """,
+        # Index rows that predate the table (schema upgrades)
+        "INSERT INTO audio_bigram (audio_bigram) VALUES ('delete-all')",
+        """
+        INSERT INTO audio_bigram (rowid, description, location, creator)
+        SELECT rowid, search_bigrams(description), search_bigrams(location),
+               search_bigrams(creator)
+        FROM audio_metadata
+        """,
+    ],
+    "audio_geo": [
+        """
+        CREATE TRIGGER IF NOT EXISTS audio_geo_ai AFTER INSERT ON audio_metadata
+        WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+            INSERT INTO audio_geo VALUES
+            (new.rowid, new.latitude, new.latitude, new.longitude, new.longitude);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS audio_geo_ad AFTER DELETE ON audio_metadata BEGIN
+            DELETE FROM audio_geo WHERE id = old.rowid;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS audio_geo_au AFTER UPDATE OF latitude, longitude
+        ON audio_metadata BEGIN
+            DELETE FROM audio_geo WHERE id = old.rowid;
+            INSERT INTO audio_geo
+            SELECT new.rowid, new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+        END
+        """,
+    ],
+    "audio_popularity": [
+        "CREATE INDEX IF NOT EXISTS idx_audio_popularity_score ON audio_popularity (score DESC)",
+    ],
+    # Serves the per-item image subquery in fetch_audio_meta
+    "images": [
+        "CREATE INDEX IF NOT EXISTS idx_images_src_id ON images (src_id)",
+    ],
+}
+
+# Tables read into the catalog snapshot. Triggers bump catalog_changes on any
+# write, including ones from seed_db.py or probe_media.py, so a worker can
+# tell at startup whether the snapshot on disk is stale.
+CHANGE_TRACKED_TABLES = ["audio_metadata", "images", "tags", "audio_tags"]
+TABLE_EXTRAS["catalog_changes"] = [
+    "INSERT OR IGNORE INTO catalog_changes (id, counter) VALUES (0, 0)"
+]
+for _table in CHANGE_TRACKED_TABLES:
+    TABLE_EXTRAS.setdefault(_table, []).extend(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {_table}_changed_{event.lower()}
+        AFTER {event} ON {_table} BEGIN
+            UPDATE catalog_changes SET counter = counter + 1;
+        END
         """
+        for event in ("INSERT", "UPDATE", "DELETE")
     )
 
+# src_ids whose snapshot entry a row write changes, per tracked table. A new
+# tag isn't linked to anything yet, so tags has no insert trigger.
+CATALOG_DIRTY_SOURCES = {
+    "audio_metadata": "SELECT {row}.src_id AS src_id",
+    "images": "SELECT {row}.src_id AS src_id",
+    "audio_tags": "SELECT {row}.src_id AS src_id",
+    "tags": "SELECT src_id FROM audio_tags WHERE tag_id = {row}.id",
+}
+for _table, _source in CATALOG_DIRTY_SOURCES.items():
+    for _event, _rows in (
+        ("INSERT", ["new"]),
+        ("UPDATE", ["old", "new"]),
+        ("DELETE", ["old"]),
+    ):
+        if _table == "tags" and _event == "INSERT":
+            continue
+        _changed = " UNION ".join(_source.format(row=row) for row in _rows)
+        # Trigger order is unspecified, so this may see the count before or
+        # after the bump above; catalog.py reads it as "changed at or after"
+        TABLE_EXTRAS[_table].append(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {_table}_dirty_{_event.lower()}
+            AFTER {_event} ON {_table} BEGIN
+                INSERT OR REPLACE INTO catalog_dirty (src_id, changed)
+                SELECT src_id, (SELECT counter FROM catalog_changes)
+                FROM ({_changed});
+            END
+            """
+        )
+
+
+# Columns added after a table first shipped, applied with ALTER TABLE on upgrade
+COLUMN_MIGRATIONS = {
+    "audio_metadata": {
+        "latitude": "REAL",
+        "longitude": "REAL",
+        "duration_seconds": "REAL",
+        "bitrate": "INTEGER",
+        "audio_bytes": "INTEGER",
+        "audio_hash": "TEXT",
+    },
+    "reset_jobs": {"worker_pid": "INTEGER"},
+    "images": {
+        "width": "INTEGER",
+        "height": "INTEGER",
+        "image_bytes": "INTEGER",
+        "image_hash": "TEXT",
+    },
+}
+
+
+def add_missing_columns(cur, table: str):
+    columns = COLUMN_MIGRATIONS.get(table)
+    if not columns:
+        return
+    cur.execute(f"PRAGMA table_info({table})")
+    existing = {row["name"] for row in cur.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+
+def schema_stamp() -> int:
+    # The shard layout is part of the stamp, changing INTERACTION_SHARDS re-runs init
+    return SCHEMA_VERSION * 1000 + INTERACTION_SHARDS
+
+
+def init_db():
+    conn = get_db()
+    cur = conn.cursor()
+
+    # Fast path: one PRAGMA read instead of replaying every CREATE TABLE
+    cur.execute("PRAGMA user_version")
+    if cur.fetchone()[0] == schema_stamp() and all(
+        os.path.exists(path) for path in interaction_db_paths()
+    ):
+        conn.close()
+        return
+
+    # media_files used to be keyed by file name. It only caches probe results,
+    # so start it over rather than migrate.
+    cur.execute("PRAGMA table_info(media_files)")
+    if any(row["name"] == "file_name" and row["pk"] for row in cur.fetchall()):
+        cur.execute("DROP TABLE media_files")
+
+    for table, ddl in CATALOG_SCHEMA.items():
+        cur.execute(ddl)
+        add_missing_columns(cur, table)
+        for extra in TABLE_EXTRAS.get(table, []):
+            cur.execute(extra)
+
+    if not INTERACTION_SHARDS:
+        create_interaction_tables(cur)
+    conn.commit()
+
+    if INTERACTION_SHARDS:
+        for path in interaction_db_paths():
+            shard = connect(path)
+            create_interaction_tables(shard.cursor())
+            shard.commit()
+            shard.close()
+        migrate_to_shards(conn)
+
+    cur.execute(f"PRAGMA user_version = {schema_stamp()}")
+    conn.commit()
+    conn.close()
+
+
+def create_interaction_tables(cur):
+    for ddl in INTERACTION_SCHEMA.values():
+        cur.execute(ddl)
+
+
+def recreate_tables(path: str, schema: dict, tables: List[str]):
+    """Drop and recreate `tables` in one transaction.
+
+    Much cheaper than DELETE on large tables, and readers keep seeing the old
+    rows until the commit swaps in the empty tables.
+    """
+    conn = connect(path)
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    for table in tables:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+        cur.execute(schema[table])
+        for extra in TABLE_EXTRAS.get(table, []):
+            cur.execute(extra)
+    if any(table in CHANGE_TRACKED_TABLES for table in tables):
+        # DROP TABLE doesn't fire the delete triggers
+        cur.execute("UPDATE catalog_changes SET counter = counter + 1")
     conn.commit()
     conn.close()
+
+
+def catalog_changes(cur) -> int:
+    cur.execute("SELECT counter FROM catalog_changes")
+    result = cur.fetchone()
+    return result["counter"] if result else 0
+
+
+def compact(path: str):
+    """Return freed pages to the filesystem after a reset."""
+    conn = connect(path)
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def migrate_to_shards(conn):
+    """Move per-user rows left in the catalog file into their shards."""
+    cur = conn.cursor()
+    placeholders = ", ".join("?" * len(INTERACTION_SCHEMA))
+    cur.execute(
+        f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({placeholders})",
+        tuple(INTERACTION_SCHEMA),
+    )
+    leftover = [row["name"] for row in cur.fetchall()]
+    if not leftover:
+        return
+
+    for index in range(INTERACTION_SHARDS):
+        cur.execute("ATTACH DATABASE ? AS shard", (shard_path(index),))
+        # Unflushed popularity deltas aren't per user, shard 0 folds them in later
+        if index == 0 and "popularity_deltas" in leftover:
+            cur.execute(
+                "INSERT OR IGNORE INTO shard.popularity_deltas SELECT * FROM main.popularity_deltas"
+            )
+        for table in [table for table in leftover if table in USER_TABLES]:
+            cur.execute(f"SELECT user_id FROM main.{table} GROUP BY user_id")
+            user_ids = [
+                row["user_id"]
+                for row in cur.fetchall()
+                if shard_for(row["user_id"] or "") == index
+            ]
+            # IS, not =: rows with a NULL user_id must move too (to shard_for(""))
+            for user_id in user_ids:
+                cur.execute(
+                    f"INSERT OR IGNORE INTO shard.{table} SELECT * FROM main.{table} WHERE user_id IS ?",
+                    (user_id,),
+                )
+        conn.commit()
+        cur.execute("DETACH DATABASE shard")
+
+    for table in leftover:
+        cur.execute(f"DROP TABLE main.{table}")
+    conn.commit()
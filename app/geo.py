@@ -0,0 +1,79 @@
+import math
+import re
+from typing import Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+# Same sphere as haversine_km, so bounding boxes never cut inside the radius
+KM_PER_DEGREE_LAT = EARTH_RADIUS_KM * math.pi / 180
+
+# "30.6598, 104.0657" style coordinates anywhere in the location text
+_COORDINATES = re.compile(r"(-?\d{1,2}\.\d+)\s*[,，]\s*(-?\d{1,3}\.\d+)")
+
+# City centres for locations that only name a place
+GAZETTEER = {
+    "成都": (30.6598, 104.0657),
+    "重庆": (29.5630, 106.5516),
+    "北京": (39.9042, 116.4074),
+    "上海": (31.2304, 121.4737),
+    "广州": (23.1291, 113.2644),
+    "深圳": (22.5431, 114.0579),
+    "杭州": (30.2741, 120.1551),
+    "西安": (34.3416, 108.9398),
+    "南京": (32.0603, 118.7969),
+    "武汉": (30.5928, 114.3055),
+    "天津": (39.3434, 117.3616),
+    "苏州": (31.2990, 120.5853),
+    "长沙": (28.2282, 112.9388),
+    "昆明": (25.0389, 102.7183),
+    "拉萨": (29.6520, 91.1721),
+}
+
+
+def parse_location(
+    location: Optional[str],
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+) -> Tuple[Optional[float], Optional[float]]:
+    """Resolve coordinates at ingestion.
+
+    Explicit latitude/longitude win, then a "lat,lng" pair in the text, then
+    the gazetteer city named earliest in it.
+    """
+    if latitude is not None and longitude is not None:
+        return latitude, longitude
+    if not location:
+        return None, None
+
+    match = _COORDINATES.search(location)
+    if match:
+        lat, lng = float(match.group(1)), float(match.group(2))
+        if -90 <= lat <= 90 and -180 <= lng <= 180:
+            return lat, lng
+
+    positions = {name: location.find(name) for name in GAZETTEER}
+    named = [name for name, position in positions.items() if position >= 0]
+    if named:
+        return GAZETTEER[min(named, key=positions.get)]
+    return None, None
+
+
+def bounding_box(lat: float, lng: float, radius_km: float):
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    # Widest longitude reached by the circle, which lies poleward of `lat`;
+    # dividing by cos(lat) alone undershoots it for large radii
+    ratio = math.sin(radius_km / EARTH_RADIUS_KM) / max(
+        math.cos(math.radians(lat)), 0.01
+    )
+    dlng = math.degrees(math.asin(ratio)) if ratio < 1 else 180.0
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = (
+        math.sin(dphi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
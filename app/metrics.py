@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Latency buckets in seconds, tuned for a SQLite-backed API
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+_lock = threading.Lock()
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help: str, labels: Tuple[str, ...], buckets=DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [bucket counts..., sum, count]
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, label_value: Tuple[str, ...], value: float):
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            items = [(k, list(v)) for k, v in sorted(self.series.items())]
+        for label_value, series in items:
+            label = _format_labels(self.labels, label_value)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{label}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, label_value: Tuple[str, ...], amount: float = 1):
+        with _lock:
+            self.series[label_value] = self.series.get(label_value, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            items = sorted(self.series.items())
+        for label_value, value in items:
+            label = _format_labels(self.labels, label_value)
+            lines.append(f"{self.name}{{{label}}} {value}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("route",)
+)
+REQUESTS_TOTAL = Counter(
+    "http_requests_total", "HTTP requests by route and status.", ("route", "status")
+)
+QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "SQLite statement latency by query label.", ("query",)
+)
+ROWS_RETURNED = Counter(
+    "db_rows_returned_total", "Rows fetched from SQLite by query label.", ("query",)
+)
+ROWS_SCANNED = Counter(
+    "db_rows_scanned_total",
+    "SQLite VM steps executed by query label (sampled; a proxy for rows scanned).",
+    ("query",),
+)
+LOCK_WAIT_SECONDS = Histogram(
+    "db_lock_wait_seconds",
+    "Time spent in explicit BEGIN IMMEDIATE waiting for the SQLite write lock.",
+    ("query",),
+)
+COMMIT_SECONDS = Histogram(
+    "db_commit_duration_seconds", "SQLite commit latency by caller.", ("caller",)
+)
+
+REGISTRY = [
+    REQUEST_SECONDS,
+    REQUESTS_TOTAL,
+    QUERY_SECONDS,
+    ROWS_RETURNED,
+    ROWS_SCANNED,
+    LOCK_WAIT_SECONDS,
+    COMMIT_SECONDS,
+]
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency by matched route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUEST_SECONDS.observe((path,), elapsed)
+            REQUESTS_TOTAL.inc((path, status[0]))
@@ -12,6 +12,8 @@ class AudioMetadata(BaseModel):
     creator: str
     tags: List[str]
     created_at: datetime
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 
 class Creator(BaseModel):
@@ -0,0 +1,130 @@
+import os
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from app import catalog, database
+
+# Catalog tables wiped by a full reset; users and creators are kept
+CATALOG_RESET_TABLES = [
+    "audio_metadata",
+    "audio_search",
+    "audio_bigram",
+    "audio_geo",
+    "images",
+    "tags",
+    "audio_tags",
+    "audio_popularity",
+]
+
+
+def create_job(kind: str) -> str:
+    job_id = uuid.uuid4().hex
+    conn = database.get_db()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO reset_jobs (job_id, kind, status, worker_pid) VALUES (?, ?, ?, ?)",
+        (job_id, kind, "queued", os.getpid()),
+    )
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    conn = database.get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM reset_jobs WHERE job_id = ?", (job_id,))
+    result = cur.fetchone()
+    conn.close()
+    return dict(result) if result else None
+
+
+def _is_alive(pid: Optional[int]) -> bool:
+    if pid is None or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def fail_stale_jobs() -> int:
+    """Mark jobs whose worker is gone as failed, run at startup.
+
+    Background tasks live in the worker that accepted the request, so a job
+    still queued or running without that process will never finish. A job
+    owned by our own pid is stale too: the pid was reused after a restart.
+    """
+    conn = database.get_db()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT job_id, worker_pid FROM reset_jobs WHERE status IN ('queued', 'running')"
+    )
+    stale = [
+        row["job_id"] for row in cur.fetchall() if not _is_alive(row["worker_pid"])
+    ]
+    conn.close()
+    for job_id in stale:
+        _set_status(job_id, "failed", "Worker exited before the job finished")
+    return len(stale)
+
+
+def _set_status(job_id: str, status: str, error: Optional[str] = None):
+    conn = database.get_db()
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE reset_jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+        (
+            status,
+            error,
+            datetime.utcnow() if status in ("done", "failed") else None,
+            job_id,
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def run_reset_job(job_id: str, kind: str, vacuum: bool = False):
+    """Run after the response is sent; progress is tracked in reset_jobs."""
+    _set_status(job_id, "running")
+    try:
+        touched = database.interaction_db_paths()
+        if kind == "database":
+            for path in touched:
+                database.recreate_tables(
+                    path, database.INTERACTION_SCHEMA, list(database.INTERACTION_SCHEMA)
+                )
+            database.recreate_tables(
+                database.DATABASE_NAME, database.CATALOG_SCHEMA, CATALOG_RESET_TABLES
+            )
+            # Deleted rows must not be served from the snapshot until the rebuild
+            catalog.invalidate()
+            touched = sorted(set(touched) | {database.DATABASE_NAME})
+        else:
+            for path in touched:
+                database.recreate_tables(
+                    path,
+                    database.INTERACTION_SCHEMA,
+                    ["user_interactions", "popularity_deltas"],
+                )
+            # Popularity is derived from the interactions just wiped
+            database.recreate_tables(
+                database.DATABASE_NAME, database.CATALOG_SCHEMA, ["audio_popularity"]
+            )
+            touched = sorted(set(touched) | {database.DATABASE_NAME})
+
+        if vacuum:
+            for path in touched:
+                database.compact(path)
+    except Exception as e:
+        _set_status(job_id, "failed", str(e))
+        return
+
+    if kind == "database":
+        catalog.request_rebuild()
+    _set_status(job_id, "done")
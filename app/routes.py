@@ -1,22 +1,40 @@
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Depends
+from fastapi.responses import PlainTextResponse
 from app.models import AudioMetadata, UserInteraction
-from app.database import get_db
-from typing import List
+from app.database import get_db, get_interaction_db, get_user_db
+from typing import List, Optional
 from app.utils import (
     post_recommend_state_update,
     recommend_random,
     recommend_by_tags,
+    recommend_trending,
+    recommend_nearby,
     fetch_audio_meta,
     no_recommended_state_update,
 )
 from app.controllers.auth import router as auth_router
 from app.middlewares.auth import authMiddleware
+from app.metrics import render_metrics
+from app import catalog, geo, reset_jobs, search, slow_queries, trending
 
 
 router = APIRouter()
 router.include_router(auth_router)
 
+RECOMMEND_STRATEGIES = {"random", "tags", "trending", "nearby"}
+
+
+def check_strategy(strategy: Optional[str], lat: Optional[float], lng: Optional[float]):
+    if strategy is not None and strategy not in RECOMMEND_STRATEGIES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown recommend strategy: {strategy}"
+        )
+    if strategy == "nearby" and (lat is None or lng is None):
+        raise HTTPException(
+            status_code=400, detail="strategy=nearby requires lat and lng"
+        )
+
 
 @router.get("/recommend/{user_id}")
 def get_recommend(
@@ -24,11 +42,22 @@ def get_recommend(
     tags: List[str] = Query(None),
     limit: int = 5,
     no_recommended: bool = False,  # TODO 这里的名字有歧义，这个参数指的是根据viewed还是recommended数据来filter接下来推荐的内容
+    strategy: Optional[str] = None,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    radius_km: float = 5.0,
 ):
-    conn = get_db()
+    check_strategy(strategy, lat, lng)
+    conn = get_user_db(user_id)
     cur = conn.cursor()
 
-    if tags:
+    if strategy == "trending":
+        recommended = recommend_trending(cur, user_id, limit, no_recommended)
+    elif strategy == "nearby":
+        recommended = recommend_nearby(
+            cur, user_id, lat, lng, radius_km, limit, no_recommended
+        )
+    elif tags:
         recommended = recommend_by_tags(cur, user_id, tags, limit, no_recommended)
     else:
         recommended = recommend_random(cur, user_id, limit, no_recommended)
@@ -51,11 +80,22 @@ def get_recommend_full(
     tags: List[str] = Query(None),
     limit: int = 5,
     no_recommended: bool = False,
+    strategy: Optional[str] = None,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    radius_km: float = 5.0,
 ):
-    conn = get_db()
+    check_strategy(strategy, lat, lng)
+    conn = get_user_db(user_id)
     cur = conn.cursor()
 
-    if tags:
+    if strategy == "trending":
+        recommended_src_ids = recommend_trending(cur, user_id, limit, no_recommended)
+    elif strategy == "nearby":
+        recommended_src_ids = recommend_nearby(
+            cur, user_id, lat, lng, radius_km, limit, no_recommended
+        )
+    elif tags:
         recommended_src_ids = recommend_by_tags(
             cur, user_id, tags, limit, no_recommended
         )
@@ -82,8 +122,34 @@ def get_recommend_full(
 
 @router.post("/user-interaction")
 def update_user_interaction(interaction: UserInteraction):
+    # Derive progress from the probed duration when known (see probe_media.py)
+    listened_percentage = interaction.listened_percentage
     conn = get_db()
     cur = conn.cursor()
+    cur.execute(
+        "SELECT duration_seconds FROM audio_metadata WHERE src_id = ?",
+        (interaction.src_id,),
+    )
+    result = cur.fetchone()
+    conn.close()
+    if result and result["duration_seconds"]:
+        listened_percentage = min(
+            interaction.listened_second / result["duration_seconds"], 1.0
+        )
+
+    # Only the user's interaction file is written, never the catalog
+    conn = get_interaction_db(interaction.user_id)
+    cur = conn.cursor()
+
+    # Lock before reading the previous state, so concurrent posts for the same
+    # row can't both count the same transition
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute(
+        "SELECT is_fav, viewed, finished FROM user_interactions WHERE user_id = ? AND src_id = ?",
+        (interaction.user_id, interaction.src_id),
+    )
+    previous = cur.fetchone()
+    trending.record_interaction(cur, interaction.src_id, previous, interaction)
 
     # Update main user interaction
     cur.execute(
@@ -99,7 +165,7 @@ def update_user_interaction(interaction: UserInteraction):
             interaction.viewed,
             interaction.finished,
             interaction.listened_second,
-            interaction.listened_percentage,
+            listened_percentage,
             interaction.recommended,
         ),
     )
@@ -128,6 +194,7 @@ def update_user_interaction(interaction: UserInteraction):
 
     conn.commit()
     conn.close()
+    trending.request_flush()
     return {"status": "success"}
 
 
@@ -144,9 +211,21 @@ def get_audio_meta(src_id: str):
     raise HTTPException(status_code=404, detail="Audio metadata not found")
 
 
+@router.get("/search")
+def search_audio(
+    q: str, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None
+):
+    conn = get_db()
+    cur = conn.cursor()
+
+    results = search.search_audio(cur, q, limit, cursor)
+    conn.close()
+    return results
+
+
 @router.get("/user-interaction/{src_id}/{user_id}")
 def get_user_interaction(src_id: str, user_id: str):
-    conn = get_db()
+    conn = get_user_db(user_id)
     cur = conn.cursor()
 
     cur.execute(
@@ -186,8 +265,16 @@ def add_audio_meta(audio: AudioMetadata):
     # Insert audio metadata
     cur.execute(
         """
-        INSERT OR REPLACE INTO audio_metadata (src_id, description, audio_src, location, creator, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
+        INSERT INTO audio_metadata (src_id, description, audio_src, location, creator, created_at, latitude, longitude)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (src_id) DO UPDATE SET
+            description = excluded.description,
+            audio_src = excluded.audio_src,
+            location = excluded.location,
+            creator = excluded.creator,
+            created_at = excluded.created_at,
+            latitude = excluded.latitude,
+            longitude = excluded.longitude
         """,
         (
             audio.src_id,
@@ -196,6 +283,7 @@ def add_audio_meta(audio: AudioMetadata):
             audio.location,
             audio.creator,
             datetime.utcnow(),  # Assuming you want to set the current time
+            *geo.parse_location(audio.location, audio.latitude, audio.longitude),
         ),
     )
 
@@ -218,53 +306,47 @@ def add_audio_meta(audio: AudioMetadata):
 
     conn.commit()
     conn.close()
+    catalog.request_rebuild()
     return {"status": "success"}
 
 
-@router.post("/reset-database")
-def reset_database():
-    conn = get_db()
-    cur = conn.cursor()
-
-    # List of tables to clean
-    tables = [
-        "user_interactions",
-        "bookmarks",
-        "comments",
-        "audio_metadata",
-        "images",
-        "tags",
-        "audio_tags",
-    ]
-
-    # Delete all entries from each table
-    for table in tables:
-        cur.execute(f"DELETE FROM {table}")
-
-    conn.commit()
-    conn.close()
-    return {"status": "database cleaned successfully"}
+@router.post("/reset-database", status_code=202)
+def reset_database(background_tasks: BackgroundTasks, vacuum: bool = False):
+    job_id = reset_jobs.create_job("database")
+    background_tasks.add_task(reset_jobs.run_reset_job, job_id, "database", vacuum)
+    return {"status": "queued", "job_id": job_id}
 
 
-@router.post("/reset-user-interactions")
-def reset_database():
-    conn = get_db()
-    cur = conn.cursor()
-
-    # List of tables to clean
-    tables = [
-        "user_interactions",
-    ]
+@router.post("/reset-user-interactions", status_code=202)
+def reset_user_interactions(background_tasks: BackgroundTasks, vacuum: bool = False):
+    job_id = reset_jobs.create_job("user-interactions")
+    background_tasks.add_task(
+        reset_jobs.run_reset_job, job_id, "user-interactions", vacuum
+    )
+    return {"status": "queued", "job_id": job_id}
 
-    # Delete all entries from each table
-    for table in tables:
-        cur.execute(f"DELETE FROM {table}")
 
-    conn.commit()
-    conn.close()
-    return {"status": "database cleaned successfully"}
+@router.get("/reset-jobs/{job_id}")
+def get_reset_job(job_id: str):
+    job = reset_jobs.get_job(job_id)
+    if job:
+        return job
+    raise HTTPException(status_code=404, detail="Reset job not found")
 
 
 @router.get("/protected-route")
 def protected_route(user: dict = Depends(authMiddleware)):
     return {"message": "This is a protected route", "user": user}
+
+
+@router.get("/admin/slow-queries")
+def get_slow_queries(limit: int = 50, user: dict = Depends(authMiddleware)):
+    return slow_queries.summary(limit)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
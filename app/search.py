@@ -0,0 +1,101 @@
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.database import SEARCH_WORD
+
+# The trigram tokenizer can only index substrings of three or more characters
+MIN_MATCH_LENGTH = 3
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[float, int]]:
+    if not cursor:
+        return None
+    try:
+        rank, rowid = cursor.split(":")
+        return float(rank), int(rowid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid search cursor")
+
+
+def _bigram_match(terms: List[str]) -> Optional[str]:
+    """FTS5 query for audio_bigram, see database.search_bigrams.
+
+    Two-character words match their bigram token, single characters match
+    as a prefix of one.
+    """
+    phrases = []
+    for term in terms:
+        for word in SEARCH_WORD.findall(term):
+            phrases.append(f'"{word}"' if len(word) == 2 else f'"{word}" *')
+    return " ".join(phrases) or None
+
+
+def search_audio(cur, q: str, limit: int, cursor: Optional[str] = None) -> dict:
+    """BM25-ranked search over description, location and creator.
+
+    Every whitespace-separated term must match as a substring, which also covers
+    prefixes. Terms of three or more characters go through the FTS5 trigram
+    index. Shorter terms (common for two-character Chinese place names) can't
+    use it and go through the audio_bigram index instead. Punctuation in
+    short terms is ignored, the index only holds letters and digits.
+    """
+    terms = q.split()
+    long_terms = [t for t in terms if len(t) >= MIN_MATCH_LENGTH]
+    bigram_match = _bigram_match([t for t in terms if len(t) < MIN_MATCH_LENGTH])
+    if not long_terms and not bigram_match:
+        raise HTTPException(status_code=400, detail="Empty search query")
+    after = parse_cursor(cursor)
+
+    params: List = []
+    if long_terms:
+        table = "audio_search"
+        match = " ".join('"' + t.replace('"', '""') + '"' for t in long_terms)
+        snippet = "snippet(audio_search, -1, '<b>', '</b>', '…', 16)"
+    else:
+        # Contentless table, there is no stored text to build a snippet from
+        table = "audio_bigram"
+        match = bigram_match
+        snippet = "am.description"
+
+    query = f"""
+        SELECT am.rowid, am.src_id, am.description, am.location, am.creator,
+               bm25({table}) as rank, {snippet} as snippet
+        FROM {table}
+        JOIN audio_metadata am ON am.rowid = {table}.rowid
+        WHERE {table} MATCH ?
+    """
+    params.append(match)
+    if long_terms and bigram_match:
+        query += " AND am.rowid IN (SELECT rowid FROM audio_bigram WHERE audio_bigram MATCH ?)"
+        params.append(bigram_match)
+    if after:
+        query += f" AND (bm25({table}) > ? OR (bm25({table}) = ? AND am.rowid > ?))"
+        params.extend([after[0], after[0], after[1]])
+    order = " ORDER BY rank, am.rowid"
+
+    query += order + " LIMIT ?"
+    params.append(limit + 1)
+
+    cur.execute(query, params)
+    rows = [dict(row) for row in cur.fetchall()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['rank']!r}:{rows[-1]['rowid']}"
+
+    return {
+        "results": [
+            {
+                "src_id": row["src_id"],
+                "description": row["description"],
+                "location": row["location"],
+                "creator": row["creator"],
+                "snippet": row["snippet"],
+                "score": -row["rank"] or 0.0,
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor,
+    }
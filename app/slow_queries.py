@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional
+
+# Opt-in: statements slower than SLOW_QUERY_MS milliseconds are recorded
+SLOW_QUERY_MS = os.getenv("SLOW_QUERY_MS")
+SLOW_QUERY_THRESHOLD: Optional[float] = (
+    float(SLOW_QUERY_MS) / 1000 if SLOW_QUERY_MS else None
+)
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.log")
+SLOW_QUERY_LOG_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+
+_lock = threading.Lock()
+_shapes: Dict[str, dict] = {}
+_normalized: Dict[str, str] = {}
+_logger: Optional[logging.Logger] = None
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+def normalize(sql: str) -> str:
+    """Reduce a statement to its shape, e.g. collapse `IN (?, ?, ?)` to `IN (?+)`."""
+    shape = _normalized.get(sql)
+    if shape is None:
+        shape = _WHITESPACE.sub(" ", sql).strip()
+        shape = _STRING_LITERAL.sub("?", shape)
+        shape = _NUMBER_LITERAL.sub("?", shape)
+        shape = _PLACEHOLDER_LIST.sub("(?+)", shape)
+        # Dynamic SQL only has a handful of shapes, but keep the cache bounded
+        if len(_normalized) < 10_000:
+            _normalized[sql] = shape
+    return shape
+
+
+def explain(conn, sql: str, parameters) -> List[str]:
+    # Use a plain cursor so the EXPLAIN itself isn't timed or recorded
+    try:
+        cur = sqlite3.Cursor(conn)
+        cur.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+        rows = cur.fetchall()
+        cur.close()
+    except sqlite3.Error:
+        return []
+
+    depth = {0: -1}
+    plan = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node_id] + detail)
+    return plan
+
+
+def _get_logger() -> logging.Logger:
+    global _logger
+    if _logger is None:
+        logger = logging.getLogger("slow_queries")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = RotatingFileHandler(
+            SLOW_QUERY_LOG,
+            maxBytes=SLOW_QUERY_LOG_BYTES,
+            backupCount=SLOW_QUERY_LOG_BACKUPS,
+            encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        _logger = logger
+    return _logger
+
+
+def record(conn, sql: str, parameters, elapsed: float, label: str):
+    shape = normalize(sql)
+    is_slow = elapsed >= SLOW_QUERY_THRESHOLD
+
+    with _lock:
+        stats = _shapes.get(shape)
+        if stats is None:
+            stats = _shapes[shape] = {
+                "shape": shape,
+                "label": label,
+                "calls": 0,
+                "total_ms": 0.0,
+                "slow_calls": 0,
+                "slow_total_ms": 0.0,
+                "max_ms": 0.0,
+                "plan": None,
+                "sample_params": None,
+                "last_slow_at": None,
+            }
+        stats["calls"] += 1
+        stats["total_ms"] += elapsed * 1000
+        if not is_slow:
+            return
+        stats["slow_calls"] += 1
+        stats["slow_total_ms"] += elapsed * 1000
+        stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+        stats["last_slow_at"] = time.time()
+        capture_plan = stats["plan"] is None
+
+    params = [p if isinstance(p, (int, float, str)) else repr(p) for p in parameters]
+    plan = explain(conn, sql, parameters) if capture_plan else stats["plan"]
+    with _lock:
+        stats["plan"] = plan
+        stats["sample_params"] = params
+
+    _get_logger().info(
+        json.dumps(
+            {
+                "ts": time.time(),
+                "label": label,
+                "elapsed_ms": round(elapsed * 1000, 3),
+                "shape": shape,
+                "sql": sql,
+                "params": params,
+                "plan": plan,
+            },
+            ensure_ascii=False,
+        )
+    )
+
+
+def summary(limit: int = 50) -> dict:
+    with _lock:
+        shapes = [dict(stats) for stats in _shapes.values() if stats["slow_calls"]]
+    shapes.sort(key=lambda stats: stats["slow_total_ms"], reverse=True)
+    for stats in shapes:
+        stats["full_scan"] = any(
+            line.lstrip().startswith("SCAN") for line in stats["plan"] or []
+        )
+    return {
+        "enabled": SLOW_QUERY_THRESHOLD is not None,
+        "threshold_ms": SLOW_QUERY_THRESHOLD * 1000 if SLOW_QUERY_THRESHOLD else None,
+        "log_file": SLOW_QUERY_LOG,
+        "shapes": shapes[:limit],
+    }
@@ -0,0 +1,231 @@
+import math
+import os
+import threading
+import time
+from typing import Optional
+
+from app import database
+
+# Events lose half their weight every TRENDING_HALF_LIFE_HOURS
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "48"))
+DECAY_SECONDS = TRENDING_HALF_LIFE_HOURS * 3600 / math.log(2)
+
+# Interaction deltas are folded into audio_popularity at most this often
+TRENDING_FLUSH_SECONDS = float(os.getenv("TRENDING_FLUSH_SECONDS", "5"))
+
+VIEW_WEIGHT = 1.0
+FINISH_WEIGHT = 3.0
+FAVORITE_WEIGHT = 5.0
+
+_lock = threading.Lock()
+_flush_timer: Optional[threading.Timer] = None
+_flush_dirty = False
+
+
+def _add_scores(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    # log(exp(a) + exp(b)), None standing for an empty sum
+    if a is None or b is None:
+        return b if a is None else a
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+# The stored score is log(sum(w * exp(t / DECAY_SECONDS))). Ranking by it at any
+# moment equals ranking by the decayed score, so nothing needs periodic
+# rewriting and a plain index on score serves the feed in index order.
+def _add_event(log_score: Optional[float], weight: float, at: float) -> float:
+    return _add_scores(log_score, math.log(weight) + at / DECAY_SECONDS)
+
+
+def record_interaction(cur, src_id: str, previous, interaction):
+    """Fold one user_interactions write into the shard's popularity_deltas.
+
+    Only state transitions count: a view is counted once per user, and
+    un-favoriting lowers the count without touching the decayed score. The
+    deltas reach audio_popularity in batches through flush_deltas, so the
+    request only writes to the user's own interaction file.
+    """
+    was_viewed = bool(previous and previous["viewed"])
+    was_finished = bool(previous and previous["finished"])
+    was_fav = bool(previous and previous["is_fav"])
+
+    views = int(interaction.viewed and not was_viewed)
+    finishes = int(interaction.finished and not was_finished)
+    favorites = int(interaction.is_fav) - int(was_fav)
+    if not (views or finishes or favorites):
+        return
+
+    cur.execute(
+        "SELECT score FROM popularity_deltas WHERE src_id = ?",
+        (src_id,),
+    )
+    result = cur.fetchone()
+    score = result["score"] if result else None
+
+    now = time.time()
+    if views:
+        score = _add_event(score, VIEW_WEIGHT, now)
+    if finishes:
+        score = _add_event(score, FINISH_WEIGHT, now)
+    if favorites > 0:
+        score = _add_event(score, FAVORITE_WEIGHT, now)
+
+    # Deltas stay signed, the clamp at zero happens when they are flushed
+    cur.execute(
+        """
+        INSERT INTO popularity_deltas (src_id, views, finishes, favorites, score)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (src_id) DO UPDATE SET
+            views = views + excluded.views,
+            finishes = finishes + excluded.finishes,
+            favorites = favorites + excluded.favorites,
+            score = excluded.score
+        """,
+        (src_id, views, finishes, favorites, score),
+    )
+
+
+def flush_deltas() -> int:
+    """Fold every shard's popularity_deltas into audio_popularity.
+
+    One transaction per shard, so a batch of interactions costs a single
+    catalog write instead of one per request.
+    """
+    flushed = 0
+    for path in database.interaction_db_paths():
+        conn = database.get_db()
+        deltas = "popularity_deltas"
+        if database.INTERACTION_SHARDS:
+            conn.execute("ATTACH DATABASE ? AS shard", (path,))
+            deltas = "shard.popularity_deltas"
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(f"SELECT * FROM {deltas}")
+        rows = cur.fetchall()
+        for row in rows:
+            cur.execute(
+                "SELECT score FROM audio_popularity WHERE src_id = ?",
+                (row["src_id"],),
+            )
+            result = cur.fetchone()
+            score = _add_scores(result["score"] if result else None, row["score"])
+            cur.execute(
+                """
+                INSERT INTO audio_popularity (src_id, views, finishes, favorites, score)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (src_id) DO UPDATE SET
+                    views = views + excluded.views,
+                    finishes = finishes + excluded.finishes,
+                    favorites = MAX(favorites + ?, 0),
+                    score = excluded.score
+                """,
+                # The insert can't start below zero, the update applies the signed delta
+                (
+                    row["src_id"],
+                    row["views"],
+                    row["finishes"],
+                    max(row["favorites"], 0),
+                    score,
+                    row["favorites"],
+                ),
+            )
+        cur.execute(f"DELETE FROM {deltas}")
+        conn.commit()
+        conn.close()
+        flushed += len(rows)
+    return flushed
+
+
+def _flush_loop():
+    global _flush_timer, _flush_dirty
+    while True:
+        with _lock:
+            if not _flush_dirty:
+                _flush_timer = None
+                return
+            _flush_dirty = False
+        try:
+            flush_deltas()
+        except Exception as e:
+            print(f"Flushing popularity deltas failed: {e}")
+        time.sleep(TRENDING_FLUSH_SECONDS)
+
+
+def request_flush():
+    """Schedule a flush after an interaction write.
+
+    A write that lands while a flush is running marks the flag again, so the
+    loop goes round once more instead of leaving it for the next request.
+    """
+    global _flush_timer, _flush_dirty
+    with _lock:
+        _flush_dirty = True
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(TRENDING_FLUSH_SECONDS, _flush_loop)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+
+def flush_now() -> int:
+    """Flush right away and leave the scheduled flush nothing to do.
+
+    For callers about to delete or hand off the database files, where a
+    timer firing later would write to files that are gone.
+    """
+    global _flush_dirty
+    with _lock:
+        _flush_dirty = False
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+    return flush_deltas()
+
+
+def rebuild_popularity():
+    """Recompute audio_popularity from user_interactions (all shards).
+
+    Interactions carry no timestamps, so every event is treated as happening
+    now and the decay starts over from the rebuild. Pending deltas are
+    dropped, they are already counted in user_interactions.
+    """
+    totals = {}
+    for path in database.interaction_db_paths():
+        conn = database.connect(path)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(
+            """
+            SELECT src_id, SUM(viewed != 0) as views, SUM(finished != 0) as finishes,
+                   SUM(is_fav != 0) as favorites
+            FROM user_interactions
+            GROUP BY src_id
+            """
+        )
+        for row in cur.fetchall():
+            counts = totals.setdefault(row["src_id"], [0, 0, 0])
+            counts[0] += row["views"] or 0
+            counts[1] += row["finishes"] or 0
+            counts[2] += row["favorites"] or 0
+        cur.execute("DELETE FROM popularity_deltas")
+        conn.commit()
+        conn.close()
+
+    # Swap the contents in one transaction so the feed never reads it empty
+    now = time.time()
+    conn = database.get_db()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM audio_popularity")
+    for src_id, (views, finishes, favorites) in totals.items():
+        weight = (
+            views * VIEW_WEIGHT + finishes * FINISH_WEIGHT + favorites * FAVORITE_WEIGHT
+        )
+        score = math.log(weight) + now / DECAY_SECONDS if weight else None
+        cur.execute(
+            """
+            INSERT INTO audio_popularity (src_id, views, finishes, favorites, score)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (src_id, views, finishes, favorites, score),
+        )
+    conn.commit()
+    conn.close()
+    return len(totals)
@@ -1,5 +1,7 @@
+import random
 from typing import List
 from app.models import AudioMetadata
+from app import catalog, geo
 from fastapi import HTTPException
 
 
@@ -64,8 +66,38 @@ def recommend_random(
     return [row["src_id"] for row in cur.fetchall()]
 
 
+def excluded_src_ids(cur, user_id: str, no_recommended: bool = False) -> set:
+    query = "SELECT src_id FROM user_interactions WHERE user_id = ? AND (viewed != 0"
+    if no_recommended:
+        query += " OR recommended != 0"
+    query += ")"
+    cur.execute(query, (user_id,))
+    return {row["src_id"] for row in cur.fetchall()}
+
+
 def recommend_by_tags(
     cur, user_id: str, tags: List[str], limit: int, no_recommended: bool = False
+) -> List[str]:
+    snapshot = catalog.current()
+    if snapshot is not None:
+        # Tag index lives in the shared snapshot; only the exclusions hit SQLite
+        excluded = excluded_src_ids(cur, user_id, no_recommended)
+        recommended = catalog.sample_by_tags(
+            snapshot, tags, limit, excluded, random.Random()
+        )
+    else:
+        recommended = recommend_by_tags_sql(cur, user_id, tags, limit, no_recommended)
+
+    if len(recommended) < limit:
+        additional = limit - len(recommended)
+        random_recs = recommend_random(cur, user_id, additional, no_recommended)
+        recommended.extend(random_recs)
+
+    return recommended[:limit]
+
+
+def recommend_by_tags_sql(
+    cur, user_id: str, tags: List[str], limit: int, no_recommended: bool = False
 ) -> List[str]:
     placeholders = ",".join(["?" for _ in tags])
     query = f"""
@@ -88,36 +120,95 @@ def recommend_by_tags(
     """
 
     cur.execute(query, (user_id, *tags, limit))
+    return [row["src_id"] for row in cur.fetchall()]
+
+
+def recommend_trending(
+    cur, user_id: str, limit: int, no_recommended: bool = False
+) -> List[str]:
+    # Walks idx_audio_popularity_score in order and stops after `limit` hits
+    query = """
+        SELECT ap.src_id FROM audio_popularity ap
+        LEFT JOIN user_interactions ui ON ap.src_id = ui.src_id AND ui.user_id = ?
+        WHERE ap.score IS NOT NULL
+        AND (ui.viewed IS NULL OR ui.viewed = 0)
+    """
+
+    if no_recommended:
+        query += " AND (ui.recommended IS NULL OR ui.recommended = 0)"
+
+    query += """
+        ORDER BY ap.score DESC
+        LIMIT ?
+    """
+
+    cur.execute(query, (user_id, limit))
     recommended = [row["src_id"] for row in cur.fetchall()]
 
     if len(recommended) < limit:
-        additional = limit - len(recommended)
-        random_recs = recommend_random(cur, user_id, additional, no_recommended)
-        recommended.extend(random_recs)
+        # Over-fetch by the trending hits, any of which the random draw may repeat
+        random_recs = recommend_random(cur, user_id, limit, no_recommended)
+        picked = set(recommended)
+        recommended.extend(r for r in random_recs if r not in picked)
 
     return recommended[:limit]
 
 
+def recommend_nearby(
+    cur,
+    user_id: str,
+    lat: float,
+    lng: float,
+    radius_km: float,
+    limit: int,
+    no_recommended: bool = False,
+) -> List[str]:
+    # Grow the search box from a small radius so dense areas stay cheap; hits
+    # inside the current radius are final because nothing closer is outside it
+    search_km = min(radius_km, 1.0)
+    while True:
+        min_lat, max_lat, min_lng, max_lng = geo.bounding_box(lat, lng, search_km)
+        query = """
+            SELECT am.src_id, am.latitude, am.longitude FROM audio_geo g
+            JOIN audio_metadata am ON am.rowid = g.id
+            LEFT JOIN user_interactions ui ON am.src_id = ui.src_id AND ui.user_id = ?
+            WHERE g.max_lat >= ? AND g.min_lat <= ? AND g.max_lng >= ? AND g.min_lng <= ?
+            AND (ui.viewed IS NULL OR ui.viewed = 0)
+        """
+
+        if no_recommended:
+            query += " AND (ui.recommended IS NULL OR ui.recommended = 0)"
+
+        cur.execute(query, (user_id, min_lat, max_lat, min_lng, max_lng))
+        nearby = []
+        for row in cur.fetchall():
+            distance = geo.haversine_km(lat, lng, row["latitude"], row["longitude"])
+            if distance <= search_km:
+                nearby.append((distance, row["src_id"]))
+
+        if len(nearby) >= limit or search_km >= radius_km:
+            nearby.sort()
+            return [src_id for _, src_id in nearby[:limit]]
+        search_km = min(radius_km, search_km * 4)
+
+
 def fetch_audio_meta(cur, src_id: str):
+    snapshot = catalog.current()
+    if snapshot is not None:
+        audio_meta = snapshot.get(src_id)
+        if audio_meta is not None:
+            return audio_meta
+        # Not in the snapshot yet (written since the last update) or deleted
+
     cur.execute(
-        """
-        SELECT am.*, GROUP_CONCAT(DISTINCT i.image_url) as images, 
-               GROUP_CONCAT(DISTINCT t.name) as tags
-        FROM audio_metadata am
-        LEFT JOIN images i ON am.src_id = i.src_id
-        LEFT JOIN audio_tags at ON am.src_id = at.src_id
-        LEFT JOIN tags t ON at.tag_id = t.id
+        catalog.AUDIO_META_SELECT
+        + """
         WHERE am.src_id = ?
         GROUP BY am.src_id
-    """,
+        """,
         (src_id,),
     )
     result = cur.fetchone()
     if result:
-        audio_meta = dict(result)
-        audio_meta["images"] = (
-            audio_meta["images"].split(",") if audio_meta["images"] else []
-        )
-        audio_meta["tags"] = audio_meta["tags"].split(",") if audio_meta["tags"] else []
-        return audio_meta
+        return catalog.parse_audio_meta(result)
     return None
@@ -0,0 +1,395 @@
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Catalog sizes that can be selected with --size
+CATALOG_SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+# uvicorn imports main:app from here, wherever the script is run from
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = "bench-data"
+RESULTS_DIR = BENCH_DIR + "/results"
+
+TAG_VOCABULARY = 200
+CREATOR_COUNT = 500
+LOCATIONS = ["成都", "重庆", "北京", "上海", "杭州", "西安", "广州", "深圳"]
+
+
+def zipf_index(rng: random.Random, n: int, s: float = 1.1) -> int:
+    # Cheap Zipf-like sampler: most picks land on the first few entries
+    return min(int(rng.paretovariate(s)) - 1, n - 1)
+
+
+def synthetic_rows(count: int, seed: int = 6677):
+    """Yield rows in the data-input CSV format consumed by seed_db.py."""
+    rng = random.Random(seed)
+    for i in range(count):
+        tag_count = rng.randint(1, 4)
+        tags = {f"tag{zipf_index(rng, TAG_VOCABULARY)}" for _ in range(tag_count)}
+        images = [f"img{i}_{n}.jpg" for n in range(rng.randint(1, 3))]
+        yield {
+            "Source_id": f"src{i:07d}",
+            "Title": f"synthetic audio {i}",
+            "Audio_url": f"audio{i}.mp3",
+            "Location": rng.choice(LOCATIONS),
+            "Creator_id": f"creator{zipf_index(rng, CREATOR_COUNT)}",
+            "Image_url": ",".join(images),
+            "Tag": ",".join(sorted(tags)),
+        }
+
+
+def build_catalog(db_path: str, count: int, users: int, seed: int = 6677):
+    # Point the app at the benchmark database before touching the schema
+    os.environ["DATABASE_NAME"] = db_path
+    import app.database
+    import seed_db
+
+    app.database.DATABASE_NAME = db_path
+    app.database.init_db()
+
+    conn = app.database.get_db()
+    cur = conn.cursor()
+    started = time.perf_counter()
+    for n, row in enumerate(synthetic_rows(count, seed), 1):
+        seed_db.insert_audio_row(cur, row)
+        if n % 50_000 == 0:
+            conn.commit()
+            print(f"  inserted {n}/{count} audio rows")
+    conn.commit()
+    conn.close()
+
+    # Interaction history: a few heavy users, a long tail of light ones
+    rng = random.Random(seed + 1)
+    interactions = 0
+    for u in range(users):
+        # Route through the user's shard when INTERACTION_SHARDS is set
+        conn = app.database.get_user_db(f"user{u}")
+        cur = conn.cursor()
+        history = min(count, int(rng.paretovariate(1.2) * 10))
+        for _ in range(history):
+            src_id = f"src{rng.randrange(count):07d}"
+            finished = rng.random() < 0.3
+            cur.execute(
+                """
+                INSERT OR REPLACE INTO user_interactions
+                (user_id, src_id, is_fav, viewed, finished, listened_second, listened_percentage, recommended)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    f"user{u}",
+                    src_id,
+                    rng.random() < 0.1,
+                    True,
+                    finished,
+                    rng.randint(0, 180),
+                    1.0 if finished else rng.random(),
+                    True,
+                ),
+            )
+            interactions += 1
+        conn.commit()
+        conn.close()
+    print(
+        f"Built {db_path}: {count} audio rows, {interactions} interactions "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+def database_files(db_path: str):
+    """The catalog file plus any interaction shards that belong to it."""
+    shards = int(os.getenv("INTERACTION_SHARDS", "0"))
+    base = db_path[:-3] if db_path.endswith(".db") else db_path
+    return [db_path] + [f"{base}.shard{index}.db" for index in range(shards)]
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, errors: int, wall_seconds: float) -> dict:
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / wall_seconds, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def endpoint_requests(count: int, users: int, seed: int = 6677):
+    """Return request factories for each benchmarked endpoint."""
+    rng = random.Random(seed + 2)
+
+    def user():
+        return f"user{rng.randrange(users)}"
+
+    def tags():
+        return [f"tag{zipf_index(rng, TAG_VOCABULARY)}" for _ in range(2)]
+
+    def interaction():
+        return {
+            "user_id": user(),
+            "src_id": f"src{rng.randrange(count):07d}",
+            "is_fav": rng.random() < 0.1,
+            "viewed": True,
+            "finished": rng.random() < 0.3,
+            "listened_second": rng.randint(0, 180),
+            "listened_percentage": rng.random(),
+            "bookmarks": [],
+            "comments": [],
+            "recommended": True,
+        }
+
+    ingest_counter = iter(range(10**9))
+
+    def audio_meta():
+        n = next(ingest_counter)
+        return {
+            "src_id": f"bench-ingest-{seed}-{n}",
+            "description": f"ingested audio {n}",
+            "audio_src": f"ingest{n}.mp3",
+            "location": rng.choice(LOCATIONS),
+            "images": [f"ingest{n}.jpg"],
+            "creator": f"creator{zipf_index(rng, CREATOR_COUNT)}",
+            "tags": tags(),
+            "created_at": datetime.utcnow().isoformat(),
+        }
+
+    return {
+        "recommend_random": lambda: ("GET", f"/recommend/{user()}", None, None),
+        "recommend_by_tags": lambda: (
+            "GET",
+            f"/recommend/{user()}",
+            {"tags": tags()},
+            None,
+        ),
+        "recommend_nearby": lambda: (
+            "GET",
+            f"/recommend/{user()}",
+            {"strategy": "nearby", "lat": 30.6598, "lng": 104.0657},
+            None,
+        ),
+        "recommend_full": lambda: ("GET", f"/recommend-full/{user()}", None, None),
+        "user_interaction": lambda: ("POST", "/user-interaction", None, interaction()),
+        "add_audio_meta": lambda: ("POST", "/add-audio-meta", None, audio_meta()),
+    }
+
+
+def run_endpoint(client, factory, requests_count: int, concurrency: int) -> dict:
+    def one(_):
+        method, url, params, body = factory()
+        started = time.perf_counter()
+        response = client.request(method, url, params=params, json=body)
+        return time.perf_counter() - started, response.status_code < 400
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, range(requests_count)))
+    else:
+        results = [one(i) for i in range(requests_count)]
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for elapsed, ok in results if ok]
+    errors = sum(1 for _, ok in results if not ok)
+    return summarize(latencies, errors, wall)
+
+
+def run_in_process(db_path: str, factories, requests_count: int) -> dict:
+    os.environ["DATABASE_NAME"] = db_path
+    import app.database
+
+    app.database.DATABASE_NAME = db_path
+    from fastapi.testclient import TestClient
+    from main import app as fastapi_app
+    from app import trending
+
+    results = {}
+    try:
+        with TestClient(fastapi_app) as client:
+            for name, factory in factories.items():
+                print(f"  in-process {name}")
+                results[name] = run_endpoint(client, factory, requests_count, 1)
+    finally:
+        # The flush timer outlives the client and would recreate the deleted files
+        trending.flush_now()
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_uvicorn(
+    db_path: str, factories, requests_count: int, concurrency: int, workers: int
+) -> dict:
+    import httpx
+
+    port = free_port()
+    # Absolute, the server runs in APP_DIR
+    env = dict(os.environ, DATABASE_NAME=os.path.abspath(db_path))
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+        cwd=APP_DIR,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        limits = httpx.Limits(max_connections=concurrency)
+        with httpx.Client(base_url=base_url, limits=limits, timeout=30) as client:
+            for _ in range(100):
+                try:
+                    client.get("/audio-meta/__ping__")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not start")
+
+            results = {}
+            for name, factory in factories.items():
+                print(f"  uvicorn {name} (concurrency={concurrency})")
+                results[name] = run_endpoint(
+                    client, factory, requests_count, concurrency
+                )
+            return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the recommend, interaction and ingest endpoints.",
+        epilog="Example usage:\n"
+        "  python benchmark.py --size 10k\n"
+        "  python benchmark.py --size 100k --mode uvicorn -c 16\n"
+        "  python benchmark.py --size 1m --rebuild -n 2000",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--size",
+        choices=CATALOG_SIZES.keys(),
+        default="10k",
+        help="Synthetic catalog size (default: 10k)",
+    )
+    parser.add_argument(
+        "--users", type=int, default=1000, help="Users with interaction history"
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["in-process", "uvicorn", "both"],
+        default="both",
+        help="Drive the app in-process, over uvicorn, or both (default: both)",
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=500, help="Requests per endpoint"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=8, help="Concurrent uvicorn clients"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="uvicorn worker processes"
+    )
+    parser.add_argument(
+        "--rebuild", action="store_true", help="Rebuild the synthetic catalog"
+    )
+    parser.add_argument("-o", "--output", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    count = CATALOG_SIZES[args.size]
+    template = f"{BENCH_DIR}/catalog-{args.size}.db"
+
+    if args.rebuild or not os.path.exists(template):
+        # Sidecars too: a stale -wal would be replayed into the new file
+        for db in database_files(template):
+            for path in glob.glob(db + "*"):
+                os.remove(path)
+        build_catalog(template, count, args.users)
+
+    report = {
+        "started_at": datetime.utcnow().isoformat(),
+        "size": args.size,
+        "catalog_rows": count,
+        "users": args.users,
+        "requests_per_endpoint": args.requests,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "results": {},
+    }
+
+    # Each mode runs against its own copy so writes from one run don't leak
+    for mode in ["in-process", "uvicorn"]:
+        if args.mode not in (mode, "both"):
+            continue
+        db_path = f"{BENCH_DIR}/run-{args.size}-{mode}.db"
+        for src, dst in zip(database_files(template), database_files(db_path)):
+            shutil.copyfile(src, dst)
+        factories = endpoint_requests(count, args.users)
+        print(f"Running {mode} benchmark against {db_path}")
+        try:
+            if mode == "in-process":
+                report["results"][mode] = run_in_process(
+                    db_path, factories, args.requests
+                )
+            else:
+                report["results"][mode] = run_uvicorn(
+                    db_path, factories, args.requests, args.concurrency, args.workers
+                )
+        finally:
+            # Shards, WAL sidecars and the catalog snapshot
+            for db in database_files(db_path):
+                for path in glob.glob(db + "*"):
+                    os.remove(path)
+
+    output = args.output or (
+        f"{RESULTS_DIR}/{args.size}-{datetime.utcnow():%Y%m%dT%H%M%S}.json"
+    )
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for mode, endpoints in report["results"].items():
+        print(f"\n{mode}")
+        for name, stats in endpoints.items():
+            print(
+                f"  {name:<18} rps={stats.get('rps', 0):>8} "
+                f"p50={stats.get('p50_ms', 0):>8}ms p95={stats.get('p95_ms', 0):>8}ms "
+                f"p99={stats.get('p99_ms', 0):>8}ms errors={stats['errors']}"
+            )
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,43 @@
+import time
+
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI
 from app.routes import router
 from app.database import init_db
+from app.catalog import init_catalog
+from app.trending import flush_deltas
+from app.reset_jobs import fail_stale_jobs
+from app.metrics import MetricsMiddleware
 import os
-import uvicorn
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(router)
 
 
 @app.on_event("startup")
 async def startup_event():
+    started = time.perf_counter()
     init_db()
+    # Deltas left behind by workers that stopped before their flush
+    flush_deltas()
+    fail_stale_jobs()
+    db_done = time.perf_counter()
+    init_catalog()
+    catalog_done = time.perf_counter()
+    print(
+        f"Startup: imports {IMPORT_SECONDS * 1000:.0f}ms, "
+        f"init_db {(db_done - started) * 1000:.0f}ms, "
+        f"init_catalog {(catalog_done - db_done) * 1000:.0f}ms"
+    )
 
 
 if __name__ == "__main__":
+    import uvicorn
+
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
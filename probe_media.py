@@ -0,0 +1,381 @@
+import argparse
+import hashlib
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from urllib.parse import unquote, urlparse
+
+from app import catalog
+from app.database import get_db, init_db
+
+AUDIO_EXTENSIONS = {".mp3"}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+# MPEG audio header tables, indexed by version bits then layer/bitrate bits
+MPEG_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG 1
+    2: (22050, 24000, 16000),  # MPEG 2
+    0: (11025, 12000, 8000),  # MPEG 2.5
+}
+MPEG1_LAYER3_BITRATES = (
+    0,
+    32,
+    40,
+    48,
+    56,
+    64,
+    80,
+    96,
+    112,
+    128,
+    160,
+    192,
+    224,
+    256,
+    320,
+)
+MPEG2_LAYER3_BITRATES = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def probe_mp3(path: str, size: int) -> dict:
+    """Duration and bitrate from the first MPEG Layer III frame.
+
+    Uses the Xing/Info frame count when present (VBR), otherwise assumes CBR.
+    """
+    with open(path, "rb") as f:
+        data = f.read(64 * 1024)
+
+    offset = 0
+    if data[:3] == b"ID3":
+        # Syncsafe tag size, plus the 10 byte header
+        offset = 10 + ((data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9])
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(64 * 1024)
+        audio_start, offset = offset, 0
+    else:
+        audio_start = 0
+
+    while offset + 4 <= len(data):
+        if data[offset] == 0xFF and data[offset + 1] & 0xE0 == 0xE0:
+            header = struct.unpack(">I", data[offset : offset + 4])[0]
+            version = (header >> 19) & 0x3
+            layer = (header >> 17) & 0x3
+            bitrate_index = (header >> 12) & 0xF
+            rate_index = (header >> 10) & 0x3
+            if (
+                version != 1
+                and layer == 1
+                and 0 < bitrate_index < 15
+                and rate_index < 3
+            ):
+                break
+        offset += 1
+    else:
+        return {}
+
+    table = MPEG1_LAYER3_BITRATES if version == 3 else MPEG2_LAYER3_BITRATES
+    bitrate = table[bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    samples_per_frame = 1152 if version == 3 else 576
+    mono = (header >> 6) & 0x3 == 3
+
+    # Xing/Info header sits after the side information of the first frame
+    if version == 3:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing = offset + 4 + side_info
+    tag = data[xing : xing + 4]
+    if tag in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", data[xing + 4 : xing + 8])[0]
+        if flags & 0x1:
+            frames = struct.unpack(">I", data[xing + 8 : xing + 12])[0]
+            duration = frames * samples_per_frame / sample_rate
+            audio_bytes = size - audio_start - offset
+            return {
+                "duration_seconds": round(duration, 3),
+                # "Info" marks a CBR encode, where the header bitrate is exact
+                "bitrate": (
+                    int(audio_bytes * 8 / duration)
+                    if tag == b"Xing" and duration
+                    else bitrate
+                ),
+            }
+
+    duration = (size - audio_start - offset) * 8 / bitrate
+    return {"duration_seconds": round(duration, 3), "bitrate": bitrate}
+
+
+def probe_image(path: str) -> dict:
+    # Sniff the format from magic bytes, extensions are not reliable
+    with open(path, "rb") as f:
+        head = f.read(32)
+        if head[:8] == b"\x89PNG\r\n\x1a\n":
+            width, height = struct.unpack(">II", head[16:24])
+            return {"width": width, "height": height}
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            width, height = struct.unpack("<HH", head[6:10])
+            return {"width": width, "height": height}
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return probe_webp(f, head)
+        if head[:2] == b"\xff\xd8":
+            return probe_jpeg(f)
+    return {}
+
+
+def probe_jpeg(f) -> dict:
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return {}
+        kind = marker[1]
+        if kind in (0xD8, 0x01) or 0xD0 <= kind <= 0xD7:
+            continue
+        length = struct.unpack(">H", f.read(2))[0]
+        # SOF0..SOF15, excluding DHT, JPG and DAC
+        if 0xC0 <= kind <= 0xCF and kind not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">xHH", f.read(5))
+            return {"width": width, "height": height}
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def probe_webp(f, head: bytes) -> dict:
+    chunk = head[12:16]
+    if chunk == b"VP8X":
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return {"width": width, "height": height}
+    f.seek(20)
+    body = f.read(10)
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", body[6:10])
+        return {"width": width & 0x3FFF, "height": height & 0x3FFF}
+    if chunk == b"VP8L":
+        bits = int.from_bytes(body[1:5], "little")
+        return {"width": (bits & 0x3FFF) + 1, "height": ((bits >> 14) & 0x3FFF) + 1}
+    return {}
+
+
+def probe_file(job) -> dict:
+    """Runs in a worker process: hash the file, probe it unless the hash is known."""
+    path, size, mtime, known_hash = job
+    content_hash = file_hash(path)
+    result = {
+        "path": path,
+        "file_name": os.path.basename(path),
+        "size": size,
+        "mtime": mtime,
+        "content_hash": content_hash,
+        "changed": content_hash != known_hash,
+    }
+    if not result["changed"]:
+        return result
+
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension in AUDIO_EXTENSIONS:
+            result["kind"] = "audio"
+            result.update(probe_mp3(path, size))
+        else:
+            result["kind"] = "image"
+            result.update(probe_image(path))
+    except (OSError, struct.error, IndexError) as e:
+        result["error"] = str(e)
+    return result
+
+
+def url_file_name(url: Optional[str]) -> str:
+    # update_urls.py prepends OSS prefixes, so match on the decoded basename
+    return os.path.basename(unquote(urlparse(url or "").path))
+
+
+def collect_files(paths):
+    # Absolute, so runs from another working directory still skip unchanged files
+    for path in map(os.path.abspath, paths):
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.isfile(path):
+            yield path
+
+
+def apply_results(cur, results, probed_paths=frozenset()) -> int:
+    """Copy probe results onto the rows whose URL names the file.
+
+    Rows already carrying the file's hash are left alone, so an unchanged run
+    writes nothing and doesn't mark the catalog snapshot stale. Results probed
+    in this run (e.g. with --force) are applied regardless. Returns the
+    number of rows updated.
+    """
+    audio_rows = {}
+    image_rows = {}
+    cur.execute("SELECT src_id, audio_src FROM audio_metadata")
+    for row in cur.fetchall():
+        audio_rows.setdefault(url_file_name(row["audio_src"]), []).append(row["src_id"])
+    cur.execute("SELECT id, image_url FROM images")
+    for row in cur.fetchall():
+        image_rows.setdefault(url_file_name(row["image_url"]), []).append(row["id"])
+
+    # Files sharing a name in different folders: the last path wins
+    by_name = {}
+    for result in sorted(results, key=lambda result: result["path"]):
+        by_name[result["file_name"]] = result
+
+    updated = 0
+    for name, result in by_name.items():
+        # NULL hash never equals the new one, so the check holds for new rows too
+        unless_current = "" if result["path"] in probed_paths else " AND {} IS NOT ?"
+        if result.get("kind") == "audio":
+            for src_id in audio_rows.get(name, []):
+                cur.execute(
+                    """
+                    UPDATE audio_metadata
+                    SET duration_seconds = ?, bitrate = ?, audio_bytes = ?, audio_hash = ?
+                    WHERE src_id = ?
+                    """
+                    + unless_current.format("audio_hash"),
+                    (
+                        result.get("duration_seconds"),
+                        result.get("bitrate"),
+                        result["size"],
+                        result["content_hash"],
+                        src_id,
+                    )
+                    + ((result["content_hash"],) if unless_current else ()),
+                )
+                updated += cur.rowcount
+        elif result.get("kind") == "image":
+            for image_id in image_rows.get(name, []):
+                cur.execute(
+                    """
+                    UPDATE images
+                    SET width = ?, height = ?, image_bytes = ?, image_hash = ?
+                    WHERE id = ?
+                    """
+                    + unless_current.format("image_hash"),
+                    (
+                        result.get("width"),
+                        result.get("height"),
+                        result["size"],
+                        result["content_hash"],
+                        image_id,
+                    )
+                    + ((result["content_hash"],) if unless_current else ()),
+                )
+                updated += cur.rowcount
+    return updated
+
+
+def probe_paths(paths, workers: Optional[int] = None, force: bool = False):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT path, size, mtime, content_hash FROM media_files")
+    known = {row["path"]: row for row in cur.fetchall()}
+
+    jobs = []
+    skipped = 0
+    for path in collect_files(paths):
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in AUDIO_EXTENSIONS | IMAGE_EXTENSIONS:
+            continue
+        stat = os.stat(path)
+        previous = known.get(path)
+        if (
+            not force
+            and previous
+            and previous["size"] == stat.st_size
+            and previous["mtime"] == stat.st_mtime
+        ):
+            skipped += 1
+            continue
+        known_hash = None if force or not previous else previous["content_hash"]
+        jobs.append((path, stat.st_size, stat.st_mtime, known_hash))
+
+    probed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(probe_file, jobs, chunksize=8):
+            if result.get("error"):
+                print(f"Failed to probe {result['path']}: {result['error']}")
+                continue
+            if not result["changed"]:
+                # Touched but identical content: just remember the new mtime
+                cur.execute(
+                    "UPDATE media_files SET mtime = ? WHERE path = ?",
+                    (result["mtime"], result["path"]),
+                )
+                skipped += 1
+                continue
+            cur.execute(
+                """
+                INSERT OR REPLACE INTO media_files
+                (path, file_name, kind, size, mtime, content_hash, duration_seconds, bitrate, width, height)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    result["path"],
+                    result["file_name"],
+                    result["kind"],
+                    result["size"],
+                    result["mtime"],
+                    result["content_hash"],
+                    result.get("duration_seconds"),
+                    result.get("bitrate"),
+                    result.get("width"),
+                    result.get("height"),
+                ),
+            )
+            probed.append(result)
+
+    # Re-link every known file so rows ingested after the media still pick it up
+    cur.execute("SELECT * FROM media_files")
+    linked = apply_results(
+        cur,
+        [dict(row) for row in cur.fetchall()],
+        {result["path"] for result in probed},
+    )
+    conn.commit()
+    conn.close()
+    return len(probed), skipped, linked
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Probe local media files and store durations, sizes, "
+        "dimensions and content hashes alongside the audio metadata.",
+        epilog="Example usage:\n"
+        "  python probe_media.py test-asset/\n"
+        "  python probe_media.py -j 8 media/audios media/photos\n"
+        "  python probe_media.py --force media/",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("paths", nargs="+", help="Media files or folders to probe.")
+    parser.add_argument(
+        "-j", "--workers", type=int, help="Worker processes (default: CPU count)"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Re-probe files even if unchanged"
+    )
+    args = parser.parse_args()
+
+    init_db()
+    probed, skipped, linked = probe_paths(args.paths, args.workers, args.force)
+    print(f"Probed {probed} files, skipped {skipped} unchanged, updated {linked} rows.")
+    if linked and catalog.CATALOG_SNAPSHOT:
+        # Running workers remap the new snapshot on their next request
+        catalog.rebuild()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
 import csv
 import os
 import sqlite3
-from app.database import get_db, init_db
+from app import catalog
+from app.database import (
+    DATABASE_NAME,
+    get_db,
+    init_db,
+    interaction_db_paths,
+    sqlite_files,
+)
+from app.trending import rebuild_popularity
+from app.geo import parse_location
 from app.models import AudioMetadata, Creator, Tag, UserInteraction
-import datetime
+from datetime import datetime
 
 DATA_INPUT_DIR = "data-input"
 ADDED_FILES_LOG = DATA_INPUT_DIR + "/added_files.log"
@@ -31,6 +40,57 @@ def process_csv_files():
             print(f"Processed and added: {filename}")
 
 
+def insert_audio_row(cur, row):
+    # Insert audio metadata
+    cur.execute(
+        """
+        INSERT INTO audio_metadata (src_id, description, audio_src, location, creator, created_at, latitude, longitude)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (src_id) DO UPDATE SET
+            description = excluded.description,
+            audio_src = excluded.audio_src,
+            location = excluded.location,
+            creator = excluded.creator,
+            created_at = excluded.created_at,
+            latitude = excluded.latitude,
+            longitude = excluded.longitude
+        """,
+        (
+            row["Source_id"],
+            row["Title"],
+            row["Audio_url"],
+            row["Location"],
+            row["Creator_id"],
+            datetime.utcnow(),  # Assuming you want to set the current time
+            # Latitude/Longitude columns are optional in the CSV
+            *parse_location(
+                row["Location"],
+                float(row["Latitude"]) if row.get("Latitude") else None,
+                float(row["Longitude"]) if row.get("Longitude") else None,
+            ),
+        ),
+    )
+    src_id = row["Source_id"]
+
+    # Insert images
+    for image_url in row["Image_url"].split(","):
+        cur.execute(
+            "INSERT INTO images (src_id, image_url) VALUES (?, ?)",
+            (src_id, image_url.strip()),
+        )
+
+    # Insert tags
+    tags = row["Tag"].split(",")
+    for tag in tags:
+        cur.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag.strip(),))
+        cur.execute("SELECT id FROM tags WHERE name = ?", (tag.strip(),))
+        tag_id = cur.fetchone()[0]
+        cur.execute(
+            "INSERT OR IGNORE INTO audio_tags (src_id, tag_id) VALUES (?, ?)",
+            (src_id, tag_id),
+        )
+
+
 def process_csv_file(file_path):
     with open(file_path, "r", encoding="utf-8-sig") as csvfile:
         reader = csv.DictReader(csvfile)
@@ -38,52 +98,44 @@ def process_csv_file(file_path):
         cur = conn.cursor()
 
         for row in reader:
-            # Insert audio metadata
-            cur.execute(
-                "INSERT OR REPLACE INTO audio_metadata (src_id, description, audio_src, location, creator, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                (
-                    row["Source_id"],
-                    row["Title"],
-                    row["Audio_url"],
-                    row["Location"],
-                    row["Creator_id"],
-                    datetime.utcnow(),  # Assuming you want to set the current time
-                ),
-            )
-            src_id = row["Source_id"]
-
-            # Insert images
-            for image_url in row["Image_url"].split(","):
-                cur.execute(
-                    "INSERT INTO images (src_id, image_url) VALUES (?, ?)",
-                    (src_id, image_url.strip()),
-                )
-
-            # Insert tags
-            tags = row["Tag"].split(",")
-            for tag in tags:
-                cur.execute(
-                    "INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag.strip(),)
-                )
-                cur.execute("SELECT id FROM tags WHERE name = ?", (tag.strip(),))
-                tag_id = cur.fetchone()[0]
-                cur.execute(
-                    "INSERT OR IGNORE INTO audio_tags (src_id, tag_id) VALUES (?, ?)",
-                    (src_id, tag_id),
-                )
+            insert_audio_row(cur, row)
 
         conn.commit()
         conn.close()
 
 
+def backfill_coordinates():
+    # Rows ingested before coordinates were parsed; the trigger fills audio_geo
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT src_id, location FROM audio_metadata WHERE latitude IS NULL")
+    rows = cur.fetchall()
+    updated = 0
+    for row in rows:
+        latitude, longitude = parse_location(row["location"])
+        if latitude is not None:
+            cur.execute(
+                "UPDATE audio_metadata SET latitude = ?, longitude = ? WHERE src_id = ?",
+                (latitude, longitude, row["src_id"]),
+            )
+            updated += 1
+    conn.commit()
+    conn.close()
+    return updated
+
+
 import sys
 import os
 
 
 def reset_db():
-    if os.path.exists("audio_app.db"):
-        os.remove("audio_app.db")
-        print("Database deleted.")
+    # The generation counter stays, running workers keep it mapped
+    databases = [DATABASE_NAME] + interaction_db_paths()
+    files = [path for db in databases for path in sqlite_files(db)]
+    for path in files + [catalog.snapshot_path(), catalog.delta_path()]:
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"Database deleted: {path}")
     if os.path.exists("data.input/added_files.log"):
         os.remove("data.input/added_files.log")
         print("Log file deleted.")
@@ -95,4 +147,16 @@ if __name__ == "__main__":
         reset_db()
         print("Database and log file reset.")
     init_db()
-    process_csv_files()
+    if "--rebuild-trending" in sys.argv:
+        # Recompute the trending aggregates from user_interactions
+        count = rebuild_popularity()
+        print(f"Rebuilt popularity for {count} audios.")
+        sys.exit()
+    if "--backfill-geo" in sys.argv:
+        count = backfill_coordinates()
+        print(f"Added coordinates to {count} audios.")
+    else:
+        process_csv_files()
+    if catalog.CATALOG_SNAPSHOT:
+        # Running workers remap the new snapshot on their next request
+        catalog.rebuild()
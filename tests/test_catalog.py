@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from app import catalog, database, reset_jobs
+
+
+@pytest.fixture
+def cur(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    monkeypatch.setattr(catalog, "CATALOG_SNAPSHOT", True)
+    monkeypatch.setattr(catalog, "CATALOG_DELTA_ROWS", 10)
+    # Each test gets its own counter file, starting from the same generation
+    monkeypatch.setattr(catalog, "_counter", None)
+    monkeypatch.setattr(catalog, "_loaded_generation", -1)
+    database.init_db()
+    conn = database.get_db()
+    cur = conn.cursor()
+    for i in range(20):
+        add(cur, f"s{i:02}", "old", "rain")
+    conn.commit()
+    catalog.init_catalog()
+    yield cur
+    conn.close()
+
+
+def add(cur, src_id, description, tag):
+    cur.execute(
+        "INSERT OR REPLACE INTO audio_metadata (src_id, description) VALUES (?, ?)",
+        (src_id, description),
+    )
+    cur.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
+    cur.execute(
+        "INSERT OR IGNORE INTO audio_tags (src_id, tag_id)"
+        " SELECT ?, id FROM tags WHERE name = ?",
+        (src_id, tag),
+    )
+
+
+def update(cur):
+    cur.connection.commit()
+    catalog.update()
+    return catalog.current()
+
+
+def test_writes_go_to_the_delta(cur):
+    cur.execute("UPDATE audio_metadata SET description = 'new' WHERE src_id = 's01'")
+    cur.execute("DELETE FROM audio_metadata WHERE src_id = 's02'")
+    cur.execute("DELETE FROM audio_tags WHERE src_id = 's02'")
+    add(cur, "s99", "added", "wind")
+    snapshot = update(cur)
+
+    assert snapshot.base.count == 20
+    assert snapshot.replaced == {"s01", "s02", "s99"}
+    assert snapshot.get("s01")["description"] == "new"
+    assert snapshot.get("s02") is None
+    assert snapshot.get("s99")["tags"] == ["wind"]
+    assert snapshot.get("s03")["description"] == "old"
+
+    rain = catalog.sample_by_tags(snapshot, ["rain"], 50, set(), random.Random(0))
+    assert sorted(rain) == sorted(f"s{i:02}" for i in range(20) if i != 2)
+
+
+def test_many_writes_merge_into_a_new_base(cur):
+    for i in range(20, 40):
+        add(cur, f"s{i:02}", "old", "rain")
+    snapshot = update(cur)
+
+    assert snapshot.base.count == 40
+    assert snapshot.delta is None
+    cur.execute(
+        "SELECT COUNT(*) FROM catalog_dirty WHERE changed < ?", (snapshot.base.changes,)
+    )
+    assert cur.fetchone()[0] == 0
+
+
+def test_reset_drops_the_snapshot(cur, monkeypatch):
+    monkeypatch.setattr(catalog, "request_rebuild", lambda: None)
+    job_id = reset_jobs.create_job("database")
+    reset_jobs.run_reset_job(job_id, "database")
+    assert catalog.current() is None
+
+    catalog.update()
+    assert catalog.current().get("s01") is None
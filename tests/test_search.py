@@ -0,0 +1,62 @@
+import pytest
+from fastapi import HTTPException
+
+from app import database, search
+
+
+@pytest.fixture
+def cur(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    database.init_db()
+    conn = database.get_db()
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO audio_metadata (src_id, description, location, creator)"
+        " VALUES (?, ?, ?, ?)",
+        [
+            ("s0", "清晨的鸟鸣", "四川省成都市", "alice"),
+            ("s1", "river at night", "重庆市", "bob"),
+            ("s2", "茶馆里的评书", "成都市锦江区", "carol"),
+            ("s3", "rain on the river bank", "杭州市", "alice"),
+        ],
+    )
+    conn.commit()
+    yield cur
+    conn.close()
+
+
+def src_ids(results):
+    return sorted(row["src_id"] for row in results["results"])
+
+
+def test_short_term_uses_bigrams(cur):
+    assert src_ids(search.search_audio(cur, "成都", 20)) == ["s0", "s2"]
+    assert src_ids(search.search_audio(cur, "鸟", 20)) == ["s0"]
+
+
+def test_long_term_uses_trigrams(cur):
+    assert src_ids(search.search_audio(cur, "river", 20)) == ["s1", "s3"]
+    assert src_ids(search.search_audio(cur, "成都市", 20)) == ["s0", "s2"]
+
+
+def test_long_and_short_terms_combine(cur):
+    assert src_ids(search.search_audio(cur, "成都市 评书", 20)) == ["s2"]
+
+
+@pytest.mark.parametrize("q", ["成都", "成都市", "river"])
+def test_paging_returns_every_row_once(cur, q):
+    expected = src_ids(search.search_audio(cur, q, 20))
+    seen, cursor = [], None
+    while True:
+        page = search.search_audio(cur, q, 1, cursor)
+        seen.extend(row["src_id"] for row in page["results"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert sorted(seen) == expected
+
+
+def test_empty_query_is_rejected(cur):
+    with pytest.raises(HTTPException) as excinfo:
+        search.search_audio(cur, " ?! ", 20)
+    assert excinfo.value.status_code == 400
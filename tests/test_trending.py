@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import database, trending
+
+
+@pytest.fixture(params=[0, 2], ids=["unsharded", "sharded"])
+def cur(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    monkeypatch.setattr(database, "INTERACTION_SHARDS", request.param)
+    database.init_db()
+    conn = database.get_interaction_db("u1")
+    yield conn.cursor()
+    conn.close()
+
+
+def interaction(is_fav=False, viewed=False, finished=False):
+    return SimpleNamespace(is_fav=is_fav, viewed=viewed, finished=finished)
+
+
+def previous(is_fav=False, viewed=False, finished=False):
+    # Stands in for the user_interactions row read before the write
+    return {"is_fav": is_fav, "viewed": viewed, "finished": finished}
+
+
+def popularity(cur, src_id):
+    cur.connection.commit()
+    trending.flush_deltas()
+    conn = database.get_db()
+    result = conn.execute(
+        "SELECT * FROM audio_popularity WHERE src_id = ?", (src_id,)
+    ).fetchone()
+    conn.close()
+    return result
+
+
+def test_unfavorite_lowers_count(cur):
+    trending.record_interaction(cur, "s0", None, interaction(is_fav=True))
+    trending.record_interaction(cur, "s0", None, interaction(is_fav=True))
+    assert popularity(cur, "s0")["favorites"] == 2
+
+    trending.record_interaction(
+        cur, "s0", previous(is_fav=True), interaction(is_fav=False)
+    )
+    assert popularity(cur, "s0")["favorites"] == 1
+
+
+def test_unfavorite_never_goes_negative(cur):
+    trending.record_interaction(
+        cur, "s1", previous(is_fav=True, viewed=True), interaction(viewed=True)
+    )
+    assert popularity(cur, "s1")["favorites"] == 0
+
+
+def test_unfavorite_across_flushes(cur):
+    trending.record_interaction(cur, "s2", None, interaction(is_fav=True))
+    assert popularity(cur, "s2")["favorites"] == 1
+
+    # The signed delta survives in the shard until the next flush
+    trending.record_interaction(
+        cur, "s2", previous(is_fav=True), interaction(is_fav=False)
+    )
+    assert popularity(cur, "s2")["favorites"] == 0
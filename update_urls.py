@@ -1,34 +1,159 @@
 import csv
 import argparse
+import glob
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import quote
 
 # Define base URLs
 audio_base_url = "https://shortaudio.oss-cn-chengdu.aliyuncs.com/音频/"
 image_base_url = "https://shortaudio.oss-cn-chengdu.aliyuncs.com/图片/"
 
-# Set up argument parser
-parser = argparse.ArgumentParser(
-    description="Update URLs in a CSV file.",
-    epilog="Example usage: python update_urls.py path/to/yourfile.csv",
-)
-parser.add_argument("csv_file", help="The path to the CSV file to be processed.")
-args = parser.parse_args()
-
-# Read the CSV file
-with open(args.csv_file, mode="r", encoding="utf-8") as infile:
-    reader = csv.DictReader(infile)
-    rows = list(reader)
-
-# Update the URLs
-for row in rows:
-    if row["Audio_url"]:
-        row["Audio_url"] = audio_base_url + row["Audio_url"]
-    if row["Image_url"] and row["Image_url"] != "Null":
-        row["Image_url"] = image_base_url + row["Image_url"]
-
-# Write the updated data back to the CSV file
-with open(args.csv_file, mode="w", encoding="utf-8", newline="") as outfile:
-    writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
-    writer.writeheader()
-    writer.writerows(rows)
-
-print("URLs updated successfully.")
+
+def prefix_url(value: str, base_url: str, encode: bool) -> str:
+    value = value.strip()
+    # Already a full URL, so running the script twice is harmless
+    if value.startswith(("http://", "https://")):
+        return value
+    if encode:
+        value = quote(value)
+    return base_url + value
+
+
+def update_row(row: dict, rules: dict):
+    if row.get("Audio_url"):
+        row["Audio_url"] = prefix_url(
+            row["Audio_url"], rules["audio_base_url"], rules["encode"]
+        )
+    if row.get("Image_url") and row["Image_url"] != "Null":
+        # Image_url may hold several comma-separated file names
+        row["Image_url"] = ",".join(
+            prefix_url(image, rules["image_base_url"], rules["encode"])
+            for image in row["Image_url"].split(",")
+            if image.strip()
+        )
+
+
+def update_file(job) -> str:
+    """Stream one CSV through the rules into a temp file, then swap it in."""
+    csv_file, output_dir, rules = job
+    target = (
+        os.path.join(output_dir, os.path.basename(csv_file)) if output_dir else csv_file
+    )
+
+    # Keep a BOM if the export had one (Excel writes it)
+    with open(csv_file, "rb") as f:
+        encoding = "utf-8-sig" if f.read(3) == b"\xef\xbb\xbf" else "utf-8"
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(target)), suffix=".csv.tmp"
+    )
+    try:
+        with open(csv_file, mode="r", encoding="utf-8-sig", newline="") as infile, open(
+            fd, mode="w", encoding=encoding, newline=""
+        ) as outfile:
+            reader = csv.DictReader(infile)
+            writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
+            writer.writeheader()
+            for row in reader:
+                update_row(row, rules)
+                writer.writerow(row)
+        if os.path.exists(target):
+            os.chmod(tmp_path, os.stat(target).st_mode)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return target
+
+
+def collect_csv_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, "*.csv"))
+        else:
+            # Plain file names are globs that match themselves
+            matches = glob.glob(path) or [path]
+        files.extend(sorted(matches))
+    # A file named twice must not be rewritten twice
+    return list(dict.fromkeys(files))
+
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(
+        description="Update URLs in CSV files. Files are streamed row by row and "
+        "replaced atomically, so a crash never leaves a half-written CSV.",
+        epilog="Example usage:\n"
+        "  python update_urls.py path/to/yourfile.csv\n"
+        "  python update_urls.py exports/ 'more/*.csv' -j 4\n"
+        "  python update_urls.py exports/ --encode -o prepared/ "
+        "--audio-prefix https://cdn.example.com/audio/",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="CSV files, folders of CSV files or glob patterns."
+    )
+    parser.add_argument(
+        "--audio-prefix",
+        default=audio_base_url,
+        help="Base URL prepended to Audio_url (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--image-prefix",
+        default=image_base_url,
+        help="Base URL prepended to each Image_url (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--encode",
+        action="store_true",
+        help="Percent-encode file names before prepending the base URL",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        help="Write updated files here instead of rewriting them in place",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="Files processed in parallel (default: CPU count)",
+    )
+    args = parser.parse_args()
+
+    csv_files = collect_csv_files(args.paths)
+    if not csv_files:
+        parser.error("no CSV files matched")
+    missing = [csv_file for csv_file in csv_files if not os.path.isfile(csv_file)]
+    if missing:
+        parser.error(f"no such file: {', '.join(missing)}")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    rules = {
+        "audio_base_url": args.audio_prefix,
+        "image_base_url": args.image_prefix,
+        "encode": args.encode,
+    }
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(update_file, (csv_file, args.output_dir, rules)): csv_file
+            for csv_file in csv_files
+        }
+        # A failed file is left untouched; keep going with the others
+        for future in as_completed(futures):
+            try:
+                print(f"URLs updated successfully: {future.result()}")
+            except Exception as e:
+                failed += 1
+                print(f"Failed to update {futures[future]}: {e}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()